@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """In-memory cache of answered questions, looked up by question-embedding similarity.
+
+    Entries are kept per vault and mode and remember which notes their sources came from, so
+    re-indexing any of those notes drops the answer. Least recently used entries are
+    evicted past `max_entries`.
+    """
+
+    def __init__(self, min_similarity=0.95, max_entries=1000):
+        self.min_similarity = min_similarity
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, mode, question_vector, vault_id=None):
+        """Return the cached result of the most similar question for this vault and mode, or None"""
+        query = self._normalize(question_vector)
+        with self._lock:
+            best_id, best_similarity = None, self.min_similarity
+            for entry_id, entry in self._entries.items():
+                if entry["mode"] != mode or entry["vault_id"] != vault_id:
+                    continue
+                similarity = float(np.dot(entry["vector"], query))
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            entry = self._entries[best_id]
+            self.hits += 1
+            self.saved_seconds += entry["latency"]
+            return entry["result"]
+
+    def add(self, mode, question, question_vector, result, note_paths, latency, vault_id=None):
+        with self._lock:
+            self._entries[self._next_id] = {
+                "mode": mode,
+                "vault_id": vault_id,
+                "question": question,
+                "vector": self._normalize(question_vector),
+                "result": result,
+                "note_paths": set(note_paths),
+                "latency": latency
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_notes(self, note_paths, vault_id=None):
+        """Drop every answer from this vault that used a source from any of these notes"""
+        note_paths = set(note_paths)
+        with self._lock:
+            stale = [
+                entry_id for entry_id, entry in self._entries.items()
+                if entry["vault_id"] == vault_id and entry["note_paths"] & note_paths
+            ]
+            for entry_id in stale:
+                del self._entries[entry_id]
+        return len(stale)
+
+    def invalidate_vault(self, vault_id):
+        """Drop every answer from this vault"""
+        with self._lock:
+            stale = [entry_id for entry_id, entry in self._entries.items() if entry["vault_id"] == vault_id]
+            for entry_id in stale:
+                del self._entries[entry_id]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "saved_seconds": round(self.saved_seconds, 2)
+            }
@@ -0,0 +1,116 @@
+from note_parser import chunk_header, CHUNK_OVERLAP
+from retrieval import estimate_tokens, CHARS_PER_TOKEN
+
+
+# Shorter matches between chunks indexed without offsets are more likely coincidence than overlap
+MIN_GUESSED_OVERLAP = 20
+
+
+def _guess_overlap(previous, text, max_overlap=CHUNK_OVERLAP):
+    """Length of the start of `text` that repeats the end of `previous`, for chunks without offsets.
+
+    Only overlaps of at least MIN_GUESSED_OVERLAP characters that start at a word
+    boundary in `previous` count, as the splitter's overlap does.
+    """
+    for size in range(min(len(previous), len(text), max_overlap), MIN_GUESSED_OVERLAP - 1, -1):
+        if previous.endswith(text[:size]) and (size == len(previous) or previous[-size - 1].isspace()):
+            return size
+    return 0
+
+
+def _join(text, text_end, doc, body):
+    """Append the next chunk's body to a section, dropping the splitter's overlap.
+
+    `text_end` is the note offset just past `text`, or None if unknown. Returns the
+    section text and its new end offset.
+    """
+    start = doc.metadata.get("start_index")
+    if start is not None and text_end is not None:
+        overlap = text_end - start
+        if overlap > 0:
+            return text + body[overlap:], start + len(body)
+        # Only stripped whitespace lies between the two chunks
+        return text + "\n" + body, start + len(body)
+    overlap = _guess_overlap(text, body)
+    if overlap:
+        return text + body[overlap:], None
+    return text + "\n" + body, None
+
+
+def _body(doc):
+    header = chunk_header(doc.metadata) if "source" in doc.metadata else ""
+    if header and doc.page_content.startswith(header):
+        return header, doc.page_content[len(header):]
+    return "", doc.page_content
+
+
+def build_context(documents, token_budget):
+    """Assemble an LLM context from relevance-ordered chunks within `token_budget` tokens.
+
+    Consecutive chunks of the same note are merged into one section under a single
+    source header with their overlapping text removed, located by the chunks'
+    `start_index` offsets. Sections are ordered by their
+    best-ranked chunk, and the last one that fits is truncated to the budget.
+
+    Returns:
+        tuple: (context text, {"chunks", "sections", "context_tokens", "naive_tokens"})
+    """
+    # Group runs of consecutive chunk_index within each note; chunks indexed before
+    # chunk_index existed are kept as their own sections
+    sections = []
+    by_note = {}
+    seen = set()
+    for rank, doc in enumerate(documents):
+        doc_key = doc.id or doc.page_content
+        if doc_key in seen:
+            continue
+        seen.add(doc_key)
+        chunk_index = doc.metadata.get("chunk_index")
+        if chunk_index is None:
+            sections.append([rank, [doc]])
+        else:
+            note_path = doc.metadata.get("note_path", doc.metadata.get("source"))
+            by_note.setdefault(note_path, {}).setdefault(chunk_index, (rank, doc))
+    for chunks in by_note.values():
+        previous_index = None
+        for chunk_index, (rank, doc) in sorted(chunks.items()):
+            if previous_index is not None and chunk_index == previous_index + 1:
+                section = sections[-1]
+                section[0] = min(section[0], rank)
+                section[1].append(doc)
+            else:
+                sections.append([rank, [doc]])
+            previous_index = chunk_index
+    sections.sort(key=lambda section: section[0])
+    
+    parts = []
+    used_tokens = 0
+    for _, docs in sections:
+        header, text = _body(docs[0])
+        start = docs[0].metadata.get("start_index")
+        text_end = start + len(text) if start is not None else None
+        for doc in docs[1:]:
+            _, body = _body(doc)
+            text, text_end = _join(text, text_end, doc, body)
+        section_text = header + text
+        
+        separator_tokens = 1 if parts else 0
+        remaining = token_budget - used_tokens - separator_tokens
+        if remaining <= 0:
+            break
+        section_tokens = estimate_tokens(section_text)
+        if section_tokens > remaining:
+            # Keep the start of the section, cut at a line break where possible
+            cut = section_text[:(remaining - 1) * CHARS_PER_TOKEN]
+            section_text = cut[:cut.rfind("\n")] if cut.rfind("\n") > len(header) else cut
+            section_tokens = estimate_tokens(section_text)
+        parts.append(section_text)
+        used_tokens += section_tokens + separator_tokens
+    
+    context = "\n\n".join(parts)
+    return context, {
+        "chunks": len(documents),
+        "sections": len(parts),
+        "context_tokens": estimate_tokens(context) if context else 0,
+        "naive_tokens": estimate_tokens("\n\n".join(doc.page_content for doc in documents)) if documents else 0
+    }
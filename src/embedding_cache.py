@@ -0,0 +1,128 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper with a disk-backed LRU cache keyed by (model name, text hash).
+
+    Vectors are stored as float32 blobs in SQLite. When the cache grows past
+    `max_entries`, the least recently used vectors are evicted. Hits only update
+    `last_used` in memory; those updates are written in one transaction every
+    `touch_flush_interval` seconds or `touch_flush_size` keys, and before evicting,
+    so a cache hit never waits for a disk sync.
+    """
+
+    def __init__(self, embeddings, cache_path, model_name, max_entries=200_000,
+                 touch_flush_interval=30.0, touch_flush_size=1000):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.touch_flush_interval = touch_flush_interval
+        self.touch_flush_size = touch_flush_size
+        self._touched = {}
+        self._touched_since = time.time()
+        self._lock = threading.Lock()
+        # Several backend workers may share the file; wait for each other's writes
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # A lost write after a power cut only costs a re-embed
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    def _key(self, kind, text):
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.model_name}:{kind}:{text_hash}"
+
+    def _lookup(self, keys):
+        cached = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, vector in rows:
+                    cached[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+            if cached:
+                now = time.time()
+                self._touched.update((key, now) for key in cached)
+                if len(self._touched) >= self.touch_flush_size or now - self._touched_since >= self.touch_flush_interval:
+                    self._flush_touched()
+        return cached
+
+    def _flush_touched(self):
+        """Write the deferred `last_used` updates; call with the lock held"""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(now, key) for key, now in self._touched.items()]
+            )
+            self._conn.commit()
+            self._touched = {}
+        self._touched_since = time.time()
+
+    def _store(self, items):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items]
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.max_entries:
+                # Evict by up-to-date recency
+                self._flush_touched()
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def _embed(self, kind, texts, embed_fn):
+        keys = [self._key(kind, text) for text in texts]
+        cached = self._lookup(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            computed = list(zip(missing.keys(), vectors))
+            self._store(computed)
+            cached.update((key, list(vector)) for key, vector in computed)
+
+        return [cached[key] for key in keys]
+
+    def embed_documents(self, texts):
+        return self._embed("doc", texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed("query", [text], lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
@@ -1,14 +1,49 @@
+import os
+import json
+import asyncio
 import uvicorn
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from typing import Optional
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from rag_chain_config import (
+    CHROMA_DB_PATH,
+    init_rag,
+    rag_status,
     run_rag_chain, 
-    process_uploaded_documents, 
-    clear_all_documents
+    stream_rag_chain,
+    save_uploaded_vault,
+    index_uploaded_vault,
+    clear_all_documents,
+    delete_vault,
+    get_rag_stats
 )
+from vault_registry import UnknownVault
+from ingestion_jobs import IngestionJobs
+from query_executor import QueryExecutor, QueryQueueFull
 
-app = FastAPI(title="RAG Agent Backend")
+QUERY_WORKERS = int(os.getenv("QUERY_WORKERS", "8"))
+QUERY_MAX_QUEUE = int(os.getenv("QUERY_MAX_QUEUE", "100"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Bind the port right away and load models and stores in the background"""
+    print("Startup: accepting connections, loading models and stores in the background")
+    startup_task = asyncio.get_running_loop().run_in_executor(None, init_rag)
+    # Failures are reported through /ready; keep the task from logging them as unretrieved
+    startup_task.add_done_callback(lambda task: task.exception())
+    yield
+
+
+app = FastAPI(title="RAG Agent Backend", lifespan=lifespan)
+
+# Job snapshots go to disk so any worker can answer GET /jobs/{job_id}
+ingestion_jobs = IngestionJobs(state_dir=os.path.join(CHROMA_DB_PATH, "jobs"))
+query_executor = QueryExecutor(max_workers=QUERY_WORKERS, max_queue=QUERY_MAX_QUEUE)
 
 
 app.add_middleware(
@@ -22,27 +57,55 @@ app.add_middleware(
 class QueryRequest(BaseModel):
     query: str
     mode: str
+    # Vault returned by /upload-vault; without one, the default vault is searched
+    session_id: Optional[str] = None
+
+
+def require_ready():
+    status = rag_status()
+    if not status["ready"]:
+        detail = f"Backend failed to start: {status['error']}" if status["error"] else "Backend is still starting, try again shortly"
+        raise HTTPException(status_code=503, detail=detail)
+
+
+@app.get("/health")
+async def health_endpoint():
+    """Liveness: the process is up and serving requests"""
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready_endpoint():
+    """Readiness: models and stores are loaded; 503 until then, with startup phase timings.
+
+    The worker's pid is included so a supervisor can wait for every worker.
+    """
+    status = {**rag_status(), "pid": os.getpid()}
+    if not status["ready"]:
+        raise HTTPException(status_code=503, detail=status)
+    return status
 
 @app.post("/upload-vault")
-async def upload_vault_endpoint(file: UploadFile = File(...)):
-    """Upload and process Obsidian vault ZIP file"""
+async def upload_vault_endpoint(file: UploadFile = File(...), session_id: Optional[str] = Form(None)):
+    """Save an Obsidian vault ZIP file and index it in a background job.
+
+    Without a session ID the upload gets a new vault; with one, that vault is re-indexed.
+    """
+    require_ready()
     try:
+        # The multipart parser has already spooled the body to a temp file; copy it
+        # to disk in chunks off the event loop rather than reading it into RAM
+        saved = await run_in_threadpool(save_uploaded_vault, file.file, file.filename, session_id)
         
+        if not saved["success"]:
+            raise HTTPException(status_code=400, detail=saved["error"])
         
-        file_content = await file.read()
-        
-        result = process_uploaded_documents(file_content, file.filename)
-        
-        if result["success"]:
-            return {
-                "success": True,
-                "message": result["message"],
-                "file_count": result["file_count"],
-                "documents_added": result["documents_added"],
-                "session_id": result["session_id"]
-            }
-        else:
-            raise HTTPException(status_code=400, detail=result["error"])
+        job_id = ingestion_jobs.submit(index_uploaded_vault, saved["session_id"], saved["zip_path"])
+        return {
+            "success": True,
+            "message": "Vault uploaded, indexing started",
+            "job_id": job_id,
+            "session_id": saved["session_id"]
+        }
         
     except HTTPException:
         raise
@@ -52,18 +115,32 @@ async def upload_vault_endpoint(file: UploadFile = File(...)):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
+@app.get("/jobs/{job_id}")
+async def job_status_endpoint(job_id: str):
+    """Report the stage, counters and throughput of a vault ingestion job"""
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
 @app.post("/rag_query")
 async def rag_query_endpoint(request: QueryRequest):
     """Handle RAG queries"""
+    require_ready()
     try:
-        rag_result = run_rag_chain(request.mode,request.query)
+        rag_result = await query_executor.run(run_rag_chain, request.mode, request.query, request.session_id)
         
         return {
             "query": request.query,
             "answer": rag_result["answer"],
             "documents": rag_result["documents"],
+            "prompt_tokens": rag_result.get("prompt_tokens"),
             "status": "success"
         }
+    except QueryQueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Server busy, try again shortly: {str(e)}")
+    except UnknownVault as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         print(f"Error during RAG processing: {e}")
         return {
@@ -73,13 +150,34 @@ async def rag_query_endpoint(request: QueryRequest):
             "status": "error"
         }
 
+@app.post("/rag_query/stream")
+async def rag_query_stream_endpoint(request: QueryRequest):
+    """Handle RAG queries, streaming the sources and then the answer as NDJSON events"""
+    require_ready()
+    async def events():
+        try:
+            async for event in query_executor.stream(stream_rag_chain, request.mode, request.query, request.session_id):
+                yield json.dumps(event, default=str) + "\n"
+        except QueryQueueFull as e:
+            yield json.dumps({"type": "error", "error": f"Server busy, try again shortly: {str(e)}"}) + "\n"
+        except UnknownVault as e:
+            yield json.dumps({"type": "error", "error": str(e)}) + "\n"
+        except Exception as e:
+            print(f"Error during RAG processing: {e}")
+            yield json.dumps({
+                "type": "error",
+                "error": f"An internal server error occurred while processing the request: {str(e)}"
+            }) + "\n"
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
 
 
 @app.post("/clear-documents")
-async def clear_documents_endpoint():
-    """Clear all uploaded documents and reset the retriever"""
+async def clear_documents_endpoint(session_id: Optional[str] = None):
+    """Clear a session's vault (or the default vault) and reset its retrievers"""
+    require_ready()
     try:
-        result = clear_all_documents()
+        result = await run_in_threadpool(clear_all_documents, session_id)
         if result["success"]:
             return {
                 "success": True,
@@ -89,9 +187,40 @@ async def clear_documents_endpoint():
             raise HTTPException(status_code=500, detail=result["error"])
     except HTTPException:
         raise
+    except UnknownVault as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error clearing documents: {str(e)}")
 
+@app.delete("/vaults/{session_id}")
+async def delete_vault_endpoint(session_id: str):
+    """Delete a session's vault: its collection, index files and cached answers"""
+    require_ready()
+    try:
+        result = await run_in_threadpool(delete_vault, session_id)
+        if result["success"]:
+            return {
+                "success": True,
+                "message": result["message"]
+            }
+        else:
+            raise HTTPException(status_code=500, detail=result["error"])
+    except HTTPException:
+        raise
+    except UnknownVault as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting vault: {str(e)}")
+
+@app.get("/stats")
+async def stats_endpoint():
+    """Query concurrency, cache and query expansion metrics"""
+    require_ready()
+    return {
+        "queries": query_executor.stats(),
+        **get_rag_stats()
+    }
+
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,60 @@
+import os
+from contextlib import contextmanager
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+@contextmanager
+def index_write_lock(lock_path):
+    """Exclusive lock across processes, held while one worker changes the index"""
+    with open(lock_path, "a+") as lock_file:
+        if os.name == "nt":
+            lock_file.seek(0)
+            # LK_LOCK retries for ~10s before raising; keep waiting like flock does
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        else:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class IndexGeneration:
+    """Counter in a small file that goes up whenever the index is re-indexed or cleared.
+
+    Every backend worker remembers the generation its retrievers were built for and
+    compares it with the file before serving a query, so changes made by another
+    worker are noticed on the next request.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def bump(self):
+        """Increment the generation; call while holding the index write lock"""
+        generation = self.read() + 1
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(generation))
+        os.replace(tmp_path, self.path)
+        return generation
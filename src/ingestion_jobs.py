@@ -0,0 +1,177 @@
+import os
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _boot_id():
+    """Identifies the current boot, so a PID from before a reboot is not mistaken for a live one"""
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _process_alive(pid):
+    if os.name == "nt":
+        # os.kill would terminate the process on Windows; rely on the snapshot heartbeat
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class IngestionJobs:
+    """Runs vault ingestion in background threads and tracks each job's progress.
+
+    Jobs run one at a time by default so concurrent uploads cannot interleave their
+    manifest and collection updates. The job function receives the job's state dict
+    and updates its progress fields in place; it must return a result dict with a
+    "success" key.
+
+    With `state_dir`, job snapshots are also written there (every `flush_interval`
+    seconds while running), so any backend worker can report on a job that another
+    worker is running. Each snapshot records the process that owns the job; a job
+    whose owner has exited, or whose snapshot has not been rewritten for
+    `stale_after` seconds, is reported as failed instead of running forever.
+    """
+
+    def __init__(self, max_workers=1, max_finished_jobs=100, state_dir=None, flush_interval=1.0, stale_after=60.0):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingestion")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_finished_jobs = max_finished_jobs
+        self.state_dir = state_dir
+        self.flush_interval = flush_interval
+        self.stale_after = stale_after
+        self.boot_id = _boot_id()
+        # Orders snapshot writes so a late periodic flush never overwrites a finished job
+        self._write_lock = threading.RLock()
+        if state_dir is not None:
+            os.makedirs(state_dir, exist_ok=True)
+            threading.Thread(target=self._flush_running, daemon=True).start()
+
+    def _job_path(self, job_id):
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _write(self, job):
+        if self.state_dir is None:
+            return
+        path = self._job_path(job["job_id"])
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with self._write_lock:
+            with open(tmp_path, "w") as f:
+                json.dump(dict(job), f, default=str)
+            os.replace(tmp_path, path)
+
+    def _flush_running(self):
+        while True:
+            time.sleep(self.flush_interval)
+            with self._lock:
+                running = [job for job in self._jobs.values() if job["finished_at"] is None]
+            for job in running:
+                with self._write_lock:
+                    if job["finished_at"] is None:
+                        self._write(job)
+
+    def submit(self, job_fn, *args, **kwargs):
+        job_id = str(uuid.uuid4())
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "stage": "queued",
+            "notes_total": 0,
+            "notes_processed": 0,
+            "chunks_embedded": 0,
+            "chunks_written": 0,
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+            "owner_pid": os.getpid(),
+            "owner_boot_id": self.boot_id
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._prune()
+        self._write(job)
+        self._executor.submit(self._run, job, job_fn, args, kwargs)
+        return job_id
+
+    def _run(self, job, job_fn, args, kwargs):
+        job["status"] = "running"
+        job["started_at"] = time.time()
+        try:
+            result = job_fn(*args, progress=job, **kwargs)
+            job["result"] = result
+            job["status"] = "completed" if result.get("success") else "failed"
+            job["error"] = result.get("error")
+        except Exception as e:
+            print(f"Ingestion job {job['job_id']} failed: {e}")
+            job["status"] = "failed"
+            job["error"] = str(e)
+        finally:
+            job["stage"] = "done"
+            job["finished_at"] = time.time()
+            self._write(job)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job["finished_at"] is not None]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+            if self.state_dir is not None:
+                try:
+                    os.remove(self._job_path(job_id))
+                except FileNotFoundError:
+                    pass
+
+    def _read(self, job_id):
+        """A job submitted to another worker, from its last written snapshot"""
+        if self.state_dir is None:
+            return None
+        path = self._job_path(job_id)
+        try:
+            with open(path) as f:
+                job = json.load(f)
+            written_at = os.path.getmtime(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        if job["finished_at"] is None and not self._owner_alive(job, written_at):
+            job["status"] = "failed"
+            job["stage"] = "done"
+            job["finished_at"] = written_at
+            job["error"] = f"The backend process running this job (pid {job.get('owner_pid')}) exited before it finished"
+        return job
+
+    def _owner_alive(self, job, written_at):
+        # Unfinished snapshots are rewritten every flush_interval while the owner runs
+        if time.time() - written_at > self.stale_after:
+            return False
+        if job.get("owner_boot_id") != self.boot_id:
+            return False
+        return job.get("owner_pid") is None or _process_alive(job["owner_pid"])
+
+    def get(self, job_id):
+        """Snapshot of a job's state with its current throughput, or None if unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job = dict(job)
+        if job is None:
+            job = self._read(job_id)
+            if job is None:
+                return None
+        end = job["finished_at"] or time.time()
+        elapsed = end - job["started_at"] if job["started_at"] else 0.0
+        job["elapsed_seconds"] = round(elapsed, 2)
+        job["chunks_per_second"] = round(job["chunks_written"] / elapsed, 1) if elapsed else 0.0
+        return job
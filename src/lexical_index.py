@@ -0,0 +1,176 @@
+import heapq
+import json
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from langchain_core.documents import Document
+
+
+# Identifiers such as hostnames, ticket numbers and paths stay whole
+# (db-01.prod, OPS-1234), and their parts are indexed as well
+TOKEN_PATTERN = re.compile(r"\w+(?:[.\-:/@#]\w+)*")
+PART_PATTERN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text):
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        parts = PART_PATTERN.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    """SQLite-backed inverted index over the vault's chunks, ranked with BM25.
+
+    Chunks are keyed by the same IDs as in the Chroma collection, so the index is
+    kept in sync by adding and deleting the same chunk IDs. In an index of at
+    least `min_chunks_for_cutoff` chunks, query terms that appear in more than
+    `max_df_ratio` of them carry almost no BM25 weight and are skipped, as long as
+    a rarer query term matched; this keeps lookups to a few short posting lists.
+    Otherwise common terms are scored like any other, so an identifier that
+    appears in most of a small vault's chunks is still found.
+    """
+
+    def __init__(self, index_path, k1=1.2, b=0.75, max_df_ratio=0.5, min_chunks_for_cutoff=100):
+        self.k1 = k1
+        self.b = b
+        self.max_df_ratio = max_df_ratio
+        self.min_chunks_for_cutoff = min_chunks_for_cutoff
+        self._lock = threading.Lock()
+        # Several backend workers may share the file; wait for each other's writes
+        self._conn = sqlite3.connect(index_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "id TEXT PRIMARY KEY, content TEXT NOT NULL, metadata TEXT NOT NULL, length INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            "term TEXT NOT NULL, chunk_id TEXT NOT NULL, tf INTEGER NOT NULL, length INTEGER NOT NULL, "
+            "PRIMARY KEY (term, chunk_id)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk_id)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL)")
+        self._conn.commit()
+        self._load_stats()
+
+    def _load_stats(self):
+        count, total_length = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks").fetchone()
+        self._chunk_count = count
+        self._total_length = total_length
+
+    @contextmanager
+    def _write(self):
+        """One write transaction; the corpus statistics are recounted before it commits"""
+        with self._lock:
+            # Take the write lock before reading, so the rows and df counts read here
+            # can't be changed by another worker before this transaction writes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+                self._conn.execute("DELETE FROM terms WHERE df <= 0")
+                # Recount rather than apply deltas: other workers change the index too
+                self._load_stats()
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def _delete(self, ids):
+        for chunk_id in ids:
+            row = self._conn.execute("SELECT 1 FROM chunks WHERE id = ?", (chunk_id,)).fetchone()
+            if row is None:
+                continue
+            self._conn.execute(
+                "UPDATE terms SET df = df - 1 WHERE term IN (SELECT term FROM postings WHERE chunk_id = ?)",
+                (chunk_id,)
+            )
+            self._conn.execute("DELETE FROM postings WHERE chunk_id = ?", (chunk_id,))
+            self._conn.execute("DELETE FROM chunks WHERE id = ?", (chunk_id,))
+
+    def add(self, documents):
+        """Index (or re-index) documents under their `id`"""
+        with self._write():
+            self._delete([doc.id for doc in documents])
+            for doc in documents:
+                term_counts = Counter(tokenize(doc.page_content))
+                length = sum(term_counts.values())
+                self._conn.execute(
+                    "INSERT INTO chunks (id, content, metadata, length) VALUES (?, ?, ?, ?)",
+                    (doc.id, doc.page_content, json.dumps(doc.metadata, default=str), length)
+                )
+                self._conn.executemany(
+                    "INSERT INTO postings (term, chunk_id, tf, length) VALUES (?, ?, ?, ?)",
+                    [(term, doc.id, tf, length) for term, tf in term_counts.items()]
+                )
+                self._conn.executemany(
+                    "INSERT INTO terms (term, df) VALUES (?, 1) ON CONFLICT (term) DO UPDATE SET df = df + 1",
+                    [(term,) for term in term_counts]
+                )
+
+    def delete(self, ids):
+        with self._write():
+            self._delete(ids)
+
+    def clear(self):
+        with self._write():
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM terms")
+            self._conn.execute("DELETE FROM chunks")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def reload(self):
+        """Re-read the corpus statistics after another process changed the index"""
+        with self._lock:
+            self._load_stats()
+
+    def __len__(self):
+        return self._chunk_count
+
+    def search(self, query, k=6):
+        """Return the top `k` chunks for the query as (Document, BM25 score), best first"""
+        terms = set(tokenize(query))
+        with self._lock:
+            if not terms or not self._chunk_count:
+                return []
+            chunk_count = self._chunk_count
+            avg_length = self._total_length / chunk_count
+            dfs = {}
+            for term in terms:
+                row = self._conn.execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+                if row is not None:
+                    dfs[term] = row[0]
+            if chunk_count >= self.min_chunks_for_cutoff:
+                rare = {term: df for term, df in dfs.items() if df <= self.max_df_ratio * chunk_count}
+                if rare:
+                    dfs = rare
+            scores = {}
+            for term, df in dfs.items():
+                idf = math.log(1 + (chunk_count - df + 0.5) / (df + 0.5))
+                for chunk_id, tf, length in self._conn.execute(
+                    "SELECT chunk_id, tf, length FROM postings WHERE term = ?", (term,)
+                ):
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            results = []
+            for chunk_id, score in top:
+                row = self._conn.execute(
+                    "SELECT content, metadata FROM chunks WHERE id = ?", (chunk_id,)
+                ).fetchone()
+                if row is None:
+                    # Removed by another worker since this worker last reloaded
+                    continue
+                content, metadata = row
+                results.append((Document(id=chunk_id, page_content=content, metadata=json.loads(metadata)), score))
+            return results
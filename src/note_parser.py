@@ -0,0 +1,145 @@
+import os
+import re
+import time
+import hashlib
+import zipfile
+from pathlib import Path, PurePosixPath
+from langchain_community.document_loaders import ObsidianLoader
+from langchain.schema import Document
+from langchain_text_splitters import  RecursiveCharacterTextSplitter
+
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+
+def clean_obsidian_links(text):
+
+    text = re.sub(r'^---\s*\n.*?\n---\s*\n', '', text, flags=re.DOTALL | re.MULTILINE)
+    text = re.sub(r'\[\[([^\]|]+)\|([^\]]+)\]\]', r'\2', text)
+    text = re.sub(r'\[\[([^\]]+)\]\]', r'\1', text)
+    text = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', text)
+
+    return text
+
+class VaultNoteLoader(ObsidianLoader):
+    """ObsidianLoader over a vault directory or a vault ZIP, optionally restricted to some notes.
+
+    Notes are addressed by their path relative to the vault root. Markdown members of a
+    ZIP are read straight out of the archive, so attachments are never extracted.
+    """
+
+    def __init__(self, path, note_paths=None, **kwargs):
+        super().__init__(path, **kwargs)
+        self.note_paths = note_paths
+        self.is_zip = os.path.isfile(path) and zipfile.is_zipfile(path)
+        self._zip = zipfile.ZipFile(path) if self.is_zip else None
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def list_notes(self):
+        if self.is_zip:
+            return [
+                info.filename for info in self._zip.infolist()
+                if not info.is_dir()
+                and info.filename.endswith(".md")
+                and not info.filename.startswith("__MACOSX/")
+            ]
+        vault_path = Path(self.file_path)
+        return [path.relative_to(vault_path).as_posix() for path in vault_path.glob("**/*.md")]
+
+    def open_note(self, note_path):
+        """Open a note's raw bytes for reading"""
+        if self.is_zip:
+            return self._zip.open(note_path)
+        return open(Path(self.file_path) / note_path, "rb")
+
+    def note_mtime(self, note_path):
+        if self.is_zip:
+            return time.mktime(self._zip.getinfo(note_path).date_time + (0, 0, -1))
+        return (Path(self.file_path) / note_path).stat().st_mtime
+
+    def load_note(self, note_path):
+        with self.open_note(note_path) as f:
+            text = f.read().decode(self.encoding)
+        mtime = self.note_mtime(note_path)
+
+        front_matter = self._parse_front_matter(text)
+        tags = self._parse_document_tags(text)
+        dataview_fields = self._parse_dataview_fields(text)
+        text = self._remove_front_matter(text)
+        metadata = {
+            "source": PurePosixPath(note_path).name,
+            "path": note_path,
+            "note_path": note_path,
+            "created": mtime,
+            "last_modified": mtime,
+            "last_accessed": mtime,
+            **self._to_langchain_compatible_metadata(front_matter),
+            **dataview_fields,
+        }
+
+        if tags or front_matter.get("tags"):
+            metadata["tags"] = ",".join(
+                tags | set(front_matter.get("tags", []) or [])
+            )
+
+        return Document(page_content=text, metadata=metadata)
+
+    def lazy_load(self):
+        note_paths = self.note_paths
+        if note_paths is None:
+            note_paths = self.list_notes()
+        for note_path in note_paths:
+            yield self.load_note(note_path)
+
+
+def make_chunk_id(note_path, chunk_index, content):
+    """Deterministic chunk ID so re-indexing the same chunk upserts instead of duplicating it"""
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{note_path}\x00{chunk_index}\x00{content_hash}".encode("utf-8")).hexdigest()
+
+
+def split_note(doc, text_splitter):
+    """Clean one loaded note and split it into ID'd chunks prefixed with the note's source"""
+    cleaned_doc = Document(
+        page_content = clean_obsidian_links(doc.page_content),
+        metadata = doc.metadata
+    )
+    chunks = text_splitter.split_documents([cleaned_doc])
+    for chunk_index, chunk in enumerate(chunks):
+        chunk.page_content = chunk_header(chunk.metadata) + chunk.page_content
+        chunk.metadata['chunk_index'] = chunk_index
+        chunk.id = make_chunk_id(chunk.metadata['note_path'], chunk_index, chunk.page_content)
+    return chunks
+
+
+def chunk_header(metadata):
+    """Source line each chunk of a note starts with"""
+    return metadata['source'].strip('.md') + "\n\n"
+
+
+def new_text_splitter():
+    # start_index (the chunk's offset in the cleaned note) lets neighbouring chunks be
+    # merged back together without guessing where their overlap is
+    return RecursiveCharacterTextSplitter(chunk_size = CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True)
+
+
+# Parse workers keep their vault open across notes instead of re-reading the ZIP
+# directory per note. Keyed by pid so forked workers never share the parent's handle.
+_worker_loaders = {}
+
+
+def load_and_split_note(obsidian_vault_path, note_path):
+    """Parse, clean and split a single note. Runs inside the parse worker processes."""
+    key = (os.getpid(), obsidian_vault_path)
+    if key not in _worker_loaders:
+        _worker_loaders[key] = VaultNoteLoader(obsidian_vault_path, collect_metadata = True)
+    return split_note(_worker_loaders[key].load_note(note_path), new_text_splitter())
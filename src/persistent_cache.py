@@ -0,0 +1,87 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class PersistentTTLCache:
+    """Small SQLite-backed key -> JSON value cache with TTL expiry and LRU eviction.
+
+    Hits update `last_used` in memory and write it out in batches (see CachedEmbeddings).
+    """
+
+    def __init__(self, cache_path, max_entries=10_000, ttl_seconds=7 * 24 * 3600,
+                 touch_flush_interval=30.0, touch_flush_size=1000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.touch_flush_interval = touch_flush_interval
+        self.touch_flush_size = touch_flush_size
+        self._touched = {}
+        self._touched_since = time.time()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_last_used ON cache (last_used)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._touched[key] = now
+            if len(self._touched) >= self.touch_flush_size or now - self._touched_since >= self.touch_flush_interval:
+                self._flush_touched()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def _flush_touched(self):
+        """Write the deferred `last_used` updates; call with the lock held"""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE cache SET last_used = ? WHERE key = ?",
+                [(now, key) for key, now in self._touched.items()]
+            )
+            self._conn.commit()
+            self._touched = {}
+        self._touched_since = time.time()
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            if count > self.max_entries:
+                self._flush_touched()
+                self._conn.execute(
+                    "DELETE FROM cache WHERE key IN "
+                    "(SELECT key FROM cache ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0
+            }
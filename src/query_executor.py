@@ -0,0 +1,105 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueryQueueFull(Exception):
+    """Raised when too many queries are already waiting for a worker"""
+
+
+class QueryExecutor:
+    """Runs blocking RAG queries on a bounded thread pool, off the event loop.
+
+    At most `max_workers` queries run at once; up to `max_queue` more wait for a
+    worker, and anything beyond that is rejected with QueryQueueFull.
+    """
+
+    def __init__(self, max_workers=8, max_queue=100):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag-query")
+        self._lock = threading.Lock()
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _call(self, fn, args):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    async def run(self, fn, *args):
+        with self._lock:
+            # Count running queries too: a query just submitted stays "queued" until a
+            # worker picks it up, so checking the queue alone rejects too early
+            if self.queued + self.running >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise QueryQueueFull(f"{self.queued} queries already waiting")
+            self.queued += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, fn, args)
+
+    async def stream(self, gen_fn, *args):
+        """Run a blocking generator on the pool and yield its items on the event loop.
+
+        The generator holds its worker for as long as it runs; if the consumer stops
+        early (e.g. the client disconnected) the generator is closed at its next item.
+        """
+        loop = asyncio.get_running_loop()
+        items = asyncio.Queue()
+        cancelled = threading.Event()
+        done = object()
+
+        def produce():
+            generator = gen_fn(*args)
+            try:
+                for item in generator:
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(items.put_nowait, (item, None))
+            except Exception as error:
+                loop.call_soon_threadsafe(items.put_nowait, (None, error))
+            finally:
+                generator.close()
+                loop.call_soon_threadsafe(items.put_nowait, (done, None))
+
+        task = asyncio.ensure_future(self.run(produce))
+        getter = None
+        try:
+            while True:
+                getter = asyncio.ensure_future(items.get())
+                if not task.done():
+                    await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                    if not getter.done():
+                        # Raises QueryQueueFull if produce() was never scheduled; otherwise
+                        # it finished and everything it produced is already queued
+                        task.result()
+                item, error = await getter
+                if error is not None:
+                    raise error
+                if item is done:
+                    break
+                yield item
+            await task
+        finally:
+            cancelled.set()
+            if getter is not None and not getter.done():
+                getter.cancel()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queue_depth": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "rejected": self.rejected
+            }
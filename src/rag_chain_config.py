@@ -1,4 +1,4 @@
-from typing import TypedDict, Annotated, List
+from typing import TypedDict, Annotated, List, BinaryIO
 from langchain_core.documents import Document
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
 from langchain_core.runnables import RunnablePassthrough
@@ -8,12 +8,32 @@ from langchain_core.tools import tool
 from langchain.retrievers.multi_query import MultiQueryRetriever
 from langchain.agents import AgentExecutor, create_react_agent
 import os
+import re
+import time
 import uuid
+import threading
+import contextvars
 import zipfile
 import tempfile
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from pathlib import Path
-from rag_indexer import prepare_parent_docs, get_vectorstore
+from rag_indexer import (
+    index_vault,
+    get_embeddings,
+    get_chroma_client,
+    scan_vault,
+    load_manifest,
+    save_manifest,
+    diff_manifest
+)
+from retrieval import multi_query_search, reciprocal_rank_fusion, is_confident, estimate_tokens
+from persistent_cache import PersistentTTLCache
+from answer_cache import SemanticAnswerCache
+from reranker import CrossEncoderReranker
+from context_builder import build_context
+from vault_registry import VaultRegistry, UnknownVault, VAULT_ID_PATTERN
 from langchain_core.prompts import PromptTemplate
 from dotenv import load_dotenv
 
@@ -23,12 +43,47 @@ load_dotenv()
 
 DOCUMENTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploaded_documents")
 CHROMA_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "chroma_db")
-
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
-
-vectorstore = get_vectorstore(CHROMA_DB_PATH)
-
-parent_docs = []
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+ENHANCER_CACHE_TTL = int(os.getenv("ENHANCER_CACHE_TTL", str(7 * 24 * 3600)))
+ENHANCER_CACHE_MAX_ENTRIES = int(os.getenv("ENHANCER_CACHE_MAX_ENTRIES", "10000"))
+# Reuse answers to near-identical earlier questions
+ANSWER_CACHE_MIN_SIMILARITY = float(os.getenv("ANSWER_CACHE_MIN_SIMILARITY", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+# Skip the query enhancer when a direct search on the question is already confident
+ADAPTIVE_EXPANSION = os.getenv("ADAPTIVE_EXPANSION", "true").lower() == "true"
+DIRECT_MIN_TOP_SIMILARITY = float(os.getenv("DIRECT_MIN_TOP_SIMILARITY", "0.6"))
+DIRECT_MIN_MEAN_SIMILARITY = float(os.getenv("DIRECT_MIN_MEAN_SIMILARITY", "0.5"))
+# Fuse a BM25 keyword ranking into retrieval, for exact identifiers embeddings miss
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true"
+# Optional cross-encoder pass that keeps only the best chunks for the QA prompt
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "6"))
+RERANK_TOKEN_BUDGET = int(os.getenv("RERANK_TOKEN_BUDGET", "2000"))
+RERANK_TIME_BUDGET_MS = int(os.getenv("RERANK_TIME_BUDGET_MS", "300"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+# Searches a summarize agent's multi-search step runs at once
+SUMMARIZE_SEARCH_WORKERS = int(os.getenv("SUMMARIZE_SEARCH_WORKERS", "4"))
+# Map-reduce summaries ("summarize_fast" mode)
+FAST_SUMMARIZE_K = int(os.getenv("FAST_SUMMARIZE_K", "30"))
+FAST_SUMMARIZE_CLUSTERS = int(os.getenv("FAST_SUMMARIZE_CLUSTERS", "5"))
+FAST_SUMMARIZE_CLUSTER_TOKENS = int(os.getenv("FAST_SUMMARIZE_CLUSTER_TOKENS", "2000"))
+FAST_SUMMARIZE_WORKERS = int(os.getenv("FAST_SUMMARIZE_WORKERS", "5"))
+# Max estimated tokens of note context sent with a QA question
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Vault indexes kept open per worker, and how long an unqueried one stays open
+VAULT_CACHE_SIZE = int(os.getenv("VAULT_CACHE_SIZE", "8"))
+VAULT_IDLE_SECONDS = int(os.getenv("VAULT_IDLE_SECONDS", "1800"))
+
+# Models, stores and the agent are built by init_rag(), not at import, so the
+# backend can bind its port (and answer /health) while they load
+llm = None
+vaults = None
+enhancer_cache = None
+agent = None
+startup_timings = {}
+startup_error = None
+_init_lock = threading.Lock()
 
 
 # )
@@ -40,17 +95,43 @@ QA_PROMPT = ChatPromptTemplate.from_messages([
     )
 
 
+ENHANCEMENT_PROMPT = ChatPromptTemplate.from_messages([
+        ("system","You are an expert assistant that helps users extract information from their notes"),
+        ("system","Based on a user's question, you will generate three queries to extract information from the notes that will help answer the question"),
+        ("system","You must generate queries that are diverse from each other but at the same time each of them is specific to a topic that will help answer the question"),
+        ("system", "Your output must be a valid JSON Object. The keys are 'query1', 'query2' and 'query3' and the values are the generated queries"),
+        ("system","Output ONLY The JSON Object with no additional comments"),
+        ("system", "Example output:\n {{'query1':'Binary search trees structure', 'query2':'Hashmaps structure', 'query3':'Linked list structure'}}"),
+        ("user","{question}")
+    ])
+
+MAP_SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+        ("system","You are a summarization expert working with a user's obsidian notes. Summarize everything the following notes say about the topic. Keep concrete facts, names and numbers, and skip anything unrelated to the topic. If nothing is relevant, answer with an empty response.\n\nNOTES:\n{context}"),
+        ("user","Topic: {topic}")
+    ])
+
+REDUCE_SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+        ("system","You are a summarization expert. Combine the following partial summaries of a user's obsidian notes into one comprehensive, well-structured summary of the topic. Merge overlapping points and do not add information that is not in the summaries.\n\nPARTIAL SUMMARIES:\n{summaries}"),
+        ("user","Topic: {topic}")
+    ])
+
+answer_cache = SemanticAnswerCache(
+    min_similarity=ANSWER_CACHE_MIN_SIMILARITY,
+    max_entries=ANSWER_CACHE_MAX_ENTRIES
+)
+
+
+
+def normalize_question(question):
+    """Cache key for a question: case, whitespace and trailing punctuation are ignored"""
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip("?!. ")
+
 
 class QAMode :
     """Simple QnA Mode: Retrieve->Generate"""
     def __init__(self):
         self.llm = llm
-        self.retriever = vectorstore.as_retriever(
-            search_type="similarity",
-            search_kwargs={
-                "k":6
-            }
-        )
+        self.k = 6
         self.prompt = QA_PROMPT
         self.output_parser = StrOutputParser()
         self.rag_chain = (
@@ -58,77 +139,163 @@ class QAMode :
             | self.llm
             | self.output_parser
         )
+        self.query_enhancer = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite")
+        self.enhancement_chain = ENHANCEMENT_PROMPT | self.query_enhancer | JsonOutputParser()
+        self.adaptive_expansion = ADAPTIVE_EXPANSION
+        self.hybrid = HYBRID_RETRIEVAL
+        self.reranker = CrossEncoderReranker(
+            RERANK_MODEL,
+            top_n=RERANK_TOP_N,
+            token_budget=RERANK_TOKEN_BUDGET,
+            time_budget=RERANK_TIME_BUDGET_MS / 1000,
+            batch_size=RERANK_BATCH_SIZE
+        ) if RERANK_ENABLED else None
+        self._stats_lock = threading.Lock()
+        self.expansions_skipped = 0
+        self.expansions_used = 0
+        self.expansion_seconds = 0.0
+        self.context_token_budget = CONTEXT_TOKEN_BUDGET
+        self.prompts = 0
+        self.prompt_tokens = 0
+        self.context_tokens_saved = 0
     
-    def retrieve_docs(self,question):
-        query_enhancer = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite")
-        enhancement_prompt = ChatPromptTemplate.from_messages([
-            ("system","You are an expert assistant that helps users extract information from their notes"),
-            ("system","Based on a user's question, you will generate three queries to extract information from the notes that will help answer the question"),
-            ("system","You must generate queries that are diverse from each other but at the same time each of them is specific to a topic that will help answer the question"),
-            ("system", "Your output must be a valid JSON Object. The keys are 'query1', 'query2' and 'query3' and the values are the generated queries"),
-            ("system","Output ONLY The JSON Object with no additional comments"),
-            ("system", "Example output:\n {{'query1':'Binary search trees structure', 'query2':'Hashmaps structure', 'query3':'Linked list structure'}}"),
-            ("user","{question}")
-        ])
-        
-        
+    def expand_question(self, question):
+        """Generate sub-queries for a question, reusing cached ones for repeat questions"""
+        cache_key = normalize_question(question)
+        queries = enhancer_cache.get(cache_key)
+        if queries is None:
+            result = self.enhancement_chain.invoke({"question":question})
+            print(result)
+            queries = [q for q in result.values() if isinstance(q, str) and q.strip()]
+            if queries:
+                enhancer_cache.set(cache_key, queries)
+        return queries or [question]
+    
+    def retrieve_docs(self, question, vault):
+        documents = self.search_docs(question, vault)
+        if self.reranker is not None:
+            documents = self.reranker.rerank(question, documents)
+        return documents
+    
+    def search_docs(self, question, vault):
+        # Keyword matches on the question itself, fused with every vector ranking below
+        lexical = [vault.lexical_index.search(question, k=self.k)] if self.hybrid else []
+        if self.adaptive_expansion:
+            direct = multi_query_search(vault.vectorstore, [question], k=self.k)[0]
+            if is_confident(direct, DIRECT_MIN_TOP_SIMILARITY, DIRECT_MIN_MEAN_SIMILARITY):
+                with self._stats_lock:
+                    self.expansions_skipped += 1
+                    saved = self.expansion_seconds / self.expansions_used if self.expansions_used else 0.0
+                print(f"Direct retrieval is confident, skipped query expansion (~{saved * 1000:.0f} ms saved)")
+                if lexical:
+                    return reciprocal_rank_fusion([direct] + lexical)[:self.k]
+                return [doc for doc, _ in direct]
+        
+        start = time.perf_counter()
+        queries = self.expand_question(question)
+        ranked_lists = multi_query_search(vault.vectorstore, queries, k=self.k)
+        with self._stats_lock:
+            self.expansions_used += 1
+            self.expansion_seconds += time.perf_counter() - start
+        print(f"Direct retrieval not confident, expanded into {len(queries)} sub-queries")
+        
+        if self.adaptive_expansion:
+            ranked_lists = [direct] + ranked_lists
+        return reciprocal_rank_fusion(ranked_lists + lexical)
+    
+    def stats(self):
+        with self._stats_lock:
+            total = self.expansions_skipped + self.expansions_used
+            avg_expansion = self.expansion_seconds / self.expansions_used if self.expansions_used else 0.0
+            return {
+                "expansions_skipped": self.expansions_skipped,
+                "expansions_used": self.expansions_used,
+                "skip_rate": round(self.expansions_skipped / total, 3) if total else 0.0,
+                "avg_expansion_ms": round(avg_expansion * 1000, 1),
+                "estimated_saved_ms": round(self.expansions_skipped * avg_expansion * 1000, 1)
+            }
+    
+    def context_stats(self):
+        with self._stats_lock:
+            return {
+                "prompts": self.prompts,
+                "avg_prompt_tokens": round(self.prompt_tokens / self.prompts, 1) if self.prompts else 0.0,
+                "context_tokens_saved": self.context_tokens_saved
+            }
+    
+    def build_prompt_inputs(self, question, documents):
+        """Chain inputs with a merged, budgeted context, and the prompt's estimated token count"""
+        context_text, context_stats = build_context(documents, self.context_token_budget)
+        inputs = {"question":question, "context":context_text}
+        prompt_tokens = estimate_tokens(self.prompt.format(**inputs))
+        saved = context_stats["naive_tokens"] - context_stats["context_tokens"]
+        with self._stats_lock:
+            self.prompts += 1
+            self.prompt_tokens += prompt_tokens
+            self.context_tokens_saved += saved
+        print(
+            f"Prompt ~{prompt_tokens} tokens: {context_stats['chunks']} chunks merged into "
+            f"{context_stats['sections']} sections, ~{saved} context tokens saved"
+        )
+        return inputs, prompt_tokens
         
-        enhancement_chain = enhancement_prompt | query_enhancer | JsonOutputParser()
-        result = enhancement_chain.invoke({"question":question})
-        print(result)
-        docs = []
-        seen_contents = set()
-        for k, v in result.items():
-            query_docs = self.retriever.invoke(v)
-            for d in query_docs:
-                content = d.page_content.strip()
-                if content not in seen_contents:
-                    docs.append(d)
-                    seen_contents.add(content)
+    def run(self, question:str, vault):
+        documents = self.retrieve_docs(question, vault)
+        inputs, prompt_tokens = self.build_prompt_inputs(question, documents)
+        answer = self.rag_chain.invoke(inputs)
+        return {"query": question, "documents": documents, "answer": answer, "prompt_tokens": prompt_tokens}
+    
+    def stream(self, question:str, vault):
+        """Yield the retrieved documents first, then the answer token by token"""
+        documents = self.retrieve_docs(question, vault)
+        inputs, prompt_tokens = self.build_prompt_inputs(question, documents)
+        yield {"type": "sources", "documents": documents, "prompt_tokens": prompt_tokens}
+        for token in self.rag_chain.stream(inputs):
+            yield {"type": "token", "content": token}
+
+class SummarizeRunState:
+    """The vault searched, sources collected and searches memoized during one summarize run"""
+    def __init__(self, vault):
+        self.vault = vault
+        self.retrieved_docs = []
+        self.seen_doc_ids = set()
+        self.search_results = {}
+        self.observed_chunks = set()
+
+
+# The agent's tools are built once and shared by every request, so each run
+# finds its own state through this context variable
+summarize_run_state = contextvars.ContextVar("summarize_run_state")
 
-        return docs
-            
-        
-        
-    def run(self, question:str):
-        documents = self.retrieve_docs(question)
-        context_text = "\n\n".join(doc.page_content for doc in documents)
-        answer = self.rag_chain.invoke({"question":question, "context":context_text})
-        return {"query": question, "documents": documents, "answer": answer}
 
 class SummarizeMode:
     def __init__(self):
         
-        self.retriever = vectorstore.as_retriever(
-            search_type="mmr",
-            search_kwargs={
-                "k":5,
-                "lambda_mult":0.5
-            }
-        )
+        self.k = 5
+        self.hybrid = HYBRID_RETRIEVAL
         self.llm = llm
-        self.retrieved_docs = []
-        self.seen_doc_ids = set()  
+        self.search_workers = SUMMARIZE_SEARCH_WORKERS
         
         @tool
         def search_vault(query:str)->str:
             """Search the Obsidian vault for information. Use this to gather context before summarizing"""
-            docs = self.retriever.invoke(query)
-            
-            for doc in docs:
-                doc_id = doc.metadata.get('source', 'unknown')
-                if doc_id not in self.seen_doc_ids:
-                    self.seen_doc_ids.add(doc_id)
-                    self.retrieved_docs.append(doc)
-            
-            results = []
-            for i, doc in enumerate(docs, 1):
-                source = doc.metadata.get('source', 'Unknown')
-                results.append(f"[{i}] Source: {source}\n{doc.page_content}\n")
-            
-            return "\n".join(results)
+            state = summarize_run_state.get()
+            return self.search_observation(state, self.search(state, query))
+        
+        @tool
+        def search_vault_multi(queries:str)->str:
+            """Run several vault searches at once. Input: the search queries separated by semicolons (;). Prefer this over repeated search_vault calls when you need several searches"""
+            state = summarize_run_state.get()
+            queries = [query.strip() for query in queries.split(";") if query.strip()]
+            with ThreadPoolExecutor(max_workers=max(1, min(self.search_workers, len(queries)))) as executor:
+                results = list(executor.map(lambda query: self.search(state, query), queries))
+            return "\n".join(
+                f"Results for \"{query}\":\n{self.search_observation(state, docs)}"
+                for query, docs in zip(queries, results)
+            )
         
         self.search_tool = search_vault
+        self.multi_search_tool = search_vault_multi
         
         template = """You are a summarization expert with access to an Obsidian knowledge base.
         Your task is to create a comprehensive summary of the given topic using the knowledge base.
@@ -156,44 +323,266 @@ class SummarizeMode:
         
         self.agent = create_react_agent(
             self.llm,
-            [self.search_tool],
+            [self.search_tool, self.multi_search_tool],
             prompt
         )
         self.agent_executor = AgentExecutor(
             agent=self.agent, 
-            tools=[self.search_tool], 
+            tools=[self.search_tool, self.multi_search_tool], 
             handle_parsing_errors=True,
             max_iterations=20,
             max_execution_time=300,
             verbose=True
         )
         
-    def run(self, topic:str):
-        self.retrieved_docs = []
-        self.seen_doc_ids = set()
-        result = self.agent_executor.invoke({"input":topic})
-        return {"query": topic, "documents": self.retrieved_docs, "answer": result["output"]}
+    def make_retriever(self, vectorstore):
+        return vectorstore.as_retriever(
+            search_type="mmr",
+            search_kwargs={
+                "k":self.k,
+                "lambda_mult":0.5
+            }
+        )
+    
+    def search(self, state, query):
+        """Retrieve chunks for a query, reusing this run's results for repeated queries"""
+        cache_key = normalize_question(query)
+        docs = state.search_results.get(cache_key)
+        if docs is None:
+            docs = self.make_retriever(state.vault.vectorstore).invoke(query)
+            if self.hybrid:
+                lexical = state.vault.lexical_index.search(query, k=self.k)
+                docs = reciprocal_rank_fusion([[(doc, None) for doc in docs], lexical])[:self.k]
+            state.search_results[cache_key] = docs
+        return docs
+    
+    def search_observation(self, state, docs):
+        """Format search results for the agent, citing chunks it has already read by reference only"""
+        for doc in docs:
+            doc_id = doc.metadata.get('source', 'unknown')
+            if doc_id not in state.seen_doc_ids:
+                state.seen_doc_ids.add(doc_id)
+                state.retrieved_docs.append(doc)
+        
+        results = []
+        new_chunks = 0
+        for i, doc in enumerate(docs, 1):
+            source = doc.metadata.get('source', 'Unknown')
+            chunk_key = doc.id or doc.page_content
+            if chunk_key in state.observed_chunks:
+                results.append(f"[{i}] Source: {source} (already seen above)\n")
+            else:
+                state.observed_chunks.add(chunk_key)
+                new_chunks += 1
+                results.append(f"[{i}] Source: {source}\n{doc.page_content}\n")
+        if docs and not new_chunks:
+            results.append("No new information for this query. Search for something else or write the final answer.\n")
+        
+        return "\n".join(results)
+    
+    def run(self, topic:str, vault):
+        state = SummarizeRunState(vault)
+        token = summarize_run_state.set(state)
+        try:
+            result = self.agent_executor.invoke({"input":topic})
+        finally:
+            summarize_run_state.reset(token)
+        return {"query": topic, "documents": state.retrieved_docs, "answer": result["output"]}
+
+
+class FastSummarizeMode:
+    """Map-reduce summaries: Retrieve once->Cluster->Summarize clusters concurrently->Combine"""
+    def __init__(self):
+        self.llm = llm
+        self.hybrid = HYBRID_RETRIEVAL
+        self.k = FAST_SUMMARIZE_K
+        self.max_clusters = FAST_SUMMARIZE_CLUSTERS
+        self.cluster_token_budget = FAST_SUMMARIZE_CLUSTER_TOKENS
+        self.map_workers = FAST_SUMMARIZE_WORKERS
+        self.map_chain = MAP_SUMMARY_PROMPT | self.llm | StrOutputParser()
+        self.reduce_chain = REDUCE_SUMMARY_PROMPT | self.llm | StrOutputParser()
+    
+    def retrieve_docs(self, topic, vault):
+        ranked_lists = multi_query_search(vault.vectorstore, [topic], k=self.k)
+        if self.hybrid:
+            ranked_lists.append(vault.lexical_index.search(topic, k=self.k))
+        return reciprocal_rank_fusion(ranked_lists)
+    
+    def cluster_docs(self, documents, vault):
+        """Group chunks by note, then group notes into at most `max_clusters` by embedding"""
+        notes = {}
+        for doc in documents:
+            notes.setdefault(doc.metadata.get("note_path", doc.metadata.get("source")), []).append(doc)
+        note_docs = list(notes.values())
+        if len(note_docs) <= self.max_clusters:
+            return note_docs
+        
+        # Imported here rather than at module level to keep backend startup fast
+        from sklearn.cluster import KMeans
+        
+        ids = [doc.id for doc in documents]
+        stored = vault.vectorstore._collection.get(ids=ids, include=["embeddings"])
+        vectors = dict(zip(stored["ids"], stored["embeddings"]))
+        note_vectors = np.array([
+            np.mean([vectors[doc.id] for doc in docs if doc.id in vectors], axis=0)
+            for docs in note_docs
+        ])
+        labels = KMeans(n_clusters=self.max_clusters, n_init=4, random_state=0).fit_predict(note_vectors)
+        
+        clusters = {}
+        for label, docs in zip(labels, note_docs):
+            clusters.setdefault(label, []).extend(docs)
+        # Keep relevance order: the cluster holding the best-ranked chunk comes first
+        return list(clusters.values())
+    
+    def map_summaries(self, topic, vault):
+        """Retrieve and cluster chunks for a topic and summarize each cluster concurrently"""
+        documents = self.retrieve_docs(topic, vault)
+        if not documents:
+            return documents, []
+        clusters = self.cluster_docs(documents, vault)
+        start = time.perf_counter()
+        summaries = self.map_chain.batch(
+            [
+                {"topic": topic, "context": build_context(cluster, self.cluster_token_budget)[0]}
+                for cluster in clusters
+            ],
+            config={"max_concurrency": self.map_workers}
+        )
+        print(f"Summarized {len(documents)} chunks in {len(clusters)} clusters in {time.perf_counter() - start:.1f}s")
+        return documents, [summary for summary in summaries if summary.strip()]
+    
+    def reduce_inputs(self, topic, summaries):
+        return {
+            "topic": topic,
+            "summaries": "\n\n".join(f"Summary {i}:\n{summary}" for i, summary in enumerate(summaries, 1))
+        }
+    
+    def run(self, topic:str, vault):
+        documents, summaries = self.map_summaries(topic, vault)
+        if not summaries:
+            answer = "I couldn't find anything about this topic in your notes."
+        elif len(summaries) == 1:
+            answer = summaries[0]
+        else:
+            answer = self.reduce_chain.invoke(self.reduce_inputs(topic, summaries))
+        return {"query": topic, "documents": documents, "answer": answer}
+    
+    def stream(self, topic:str, vault):
+        """Yield the retrieved documents once the map step is done, then the combined summary token by token"""
+        documents, summaries = self.map_summaries(topic, vault)
+        yield {"type": "sources", "documents": documents, "prompt_tokens": None}
+        if not summaries:
+            yield {"type": "token", "content": "I couldn't find anything about this topic in your notes."}
+        elif len(summaries) == 1:
+            yield {"type": "token", "content": summaries[0]}
+        else:
+            for token in self.reduce_chain.stream(self.reduce_inputs(topic, summaries)):
+                yield {"type": "token", "content": token}
 
 
 class ObsidianAgent:
     def __init__(self):
         self.qa_mode = QAMode()
         self.summarize_mode = SummarizeMode()
+        self.fast_summarize_mode = FastSummarizeMode()
     
-    def run(self, mode, input_text):
+    def run(self, mode, input_text, vault):
+        """Answer from one vault's index; the modes are shared by every vault"""
         mode = mode.lower()
         
         if mode == "qa":
-            return self.qa_mode.run(input_text)
+            return self.qa_mode.run(input_text, vault)
         elif mode == "summarize":
-            return self.summarize_mode.run(input_text)
+            return self.summarize_mode.run(input_text, vault)
+        elif mode == "summarize_fast":
+            return self.fast_summarize_mode.run(input_text, vault)
+        raise ValueError(f"Unknown mode: {mode}")
+    
+    def streaming_mode(self, mode):
+        """The mode object that can stream its answer token by token, if any"""
+        return {"qa": self.qa_mode, "summarize_fast": self.fast_summarize_mode}.get(mode.lower())
 
-agent = ObsidianAgent()
 
-def run_rag_chain(mode,input_text):
-    final_state = agent.run(mode, input_text)
-    
-    documents = final_state.get("documents", [])
+
+def _timed(phase, fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    startup_timings[phase] = round(time.perf_counter() - start, 3)
+    print(f"Startup: {phase} took {startup_timings[phase]:.2f}s")
+    return result
+
+
+def _load_embeddings():
+    embeddings = get_embeddings(CHROMA_DB_PATH)
+    # Run the model once so the first query doesn't pay for lazy initialization
+    embeddings.embeddings.embed_documents(["warm up"])
+    return embeddings
+
+
+def init_rag():
+    """Load the models and stores and build the agent; later calls return immediately.
+
+    The embedding model, the Chroma client and the Gemini clients load concurrently.
+    Only the default vault is opened here; uploaded vaults are opened on first use.
+    """
+    global llm, vaults, enhancer_cache, agent, startup_error
+    with _init_lock:
+        if agent is not None:
+            return
+        start = time.perf_counter()
+        startup_error = None
+        try:
+            with ThreadPoolExecutor(max_workers=3, thread_name_prefix="rag-startup") as executor:
+                embeddings_future = executor.submit(_timed, "embedding_model", _load_embeddings)
+                client_future = executor.submit(_timed, "chroma_client", get_chroma_client, CHROMA_DB_PATH)
+                llm_future = executor.submit(_timed, "llm_client", ChatGoogleGenerativeAI, model="gemini-2.5-flash")
+                llm = llm_future.result()
+                embeddings = embeddings_future.result()
+                client = client_future.result()
+            
+            vaults = _timed(
+                "default_vault",
+                VaultRegistry,
+                CHROMA_DB_PATH,
+                embeddings,
+                client,
+                max_open=VAULT_CACHE_SIZE,
+                idle_seconds=VAULT_IDLE_SECONDS
+            )
+            enhancer_cache = PersistentTTLCache(
+                os.path.join(CHROMA_DB_PATH, "enhancer_cache.sqlite3"),
+                max_entries=ENHANCER_CACHE_MAX_ENTRIES,
+                ttl_seconds=ENHANCER_CACHE_TTL
+            )
+            agent = _timed("agent", ObsidianAgent)
+        except Exception as e:
+            startup_error = str(e)
+            print(f"Startup failed: {e}")
+            raise
+        startup_timings["total"] = round(time.perf_counter() - start, 3)
+        print(f"Startup: ready in {startup_timings['total']:.2f}s")
+
+
+def refresh_if_stale(vault):
+    """Pick up re-index and clear events made to a vault by other backend workers"""
+    start = time.perf_counter()
+    if vault.refresh_if_stale():
+        answer_cache.invalidate_vault(vault.vault_id)
+        print(
+            f"Vault {vault.vault_id or 'default'} index generation {vault.seen_generation}: "
+            f"refreshed retrievers in {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+
+
+def rag_status() -> dict:
+    return {
+        "ready": agent is not None,
+        "error": startup_error,
+        "timings": dict(startup_timings)
+    }
+
+def format_documents(documents):
     documents_unique =[]
     for doc in documents:
         if doc.metadata.get("source","unknown") not in documents_unique:
@@ -214,71 +603,150 @@ def run_rag_chain(mode,input_text):
         doc_info["title"] = title
         document_info.append(doc_info)
     
-    return {
-        "answer": final_state["answer"],
-        "documents": document_info
-    }
+    return document_info
+
+
+def cache_answer(vault, mode, input_text, question_vector, result, documents, start, generation):
+    """Cache an answer unless the vault's index changed while it was being computed"""
+    if vault.generation.read() != generation:
+        # The change's invalidation has already run, so it would never drop this answer
+        return
+    # Answers without sources would never be invalidated by re-indexing
+    note_paths = {doc.metadata.get("note_path", doc.metadata.get("source")) for doc in documents}
+    if note_paths:
+        answer_cache.add(
+            mode, input_text, question_vector, result, note_paths, time.perf_counter() - start,
+            vault_id=vault.vault_id
+        )
 
 
+def run_rag_chain(mode, input_text, session_id=None):
+    """Answer from the vault uploaded under `session_id`, or the default vault without one"""
+    with vaults.use(session_id) as vault:
+        refresh_if_stale(vault)
+        generation = vault.generation.read()
+        start = time.perf_counter()
+        mode = mode.lower()
+        # Same embedding path (and cache entry) as the direct search in QAMode
+        question_vector = vaults.embeddings.embed_documents([input_text])[0]
+        cached_result = answer_cache.lookup(mode, question_vector, vault_id=vault.vault_id)
+        if cached_result is not None:
+            return cached_result
+        
+        final_state = agent.run(mode, input_text, vault)
+        
+        documents = final_state.get("documents", [])
+        result = {
+            "answer": final_state["answer"],
+            "documents": format_documents(documents),
+            "prompt_tokens": final_state.get("prompt_tokens")
+        }
+        cache_answer(vault, mode, input_text, question_vector, result, documents, start, generation)
+        
+        return result
 
 
+def stream_rag_chain(mode, input_text, session_id=None):
+    """Like run_rag_chain, but yields events as they become available:
+    {"type": "sources"} once retrieval is done, then {"type": "token"} chunks of the
+    answer, then {"type": "done"} with the full answer.
+    """
+    with vaults.use(session_id) as vault:
+        refresh_if_stale(vault)
+        generation = vault.generation.read()
+        start = time.perf_counter()
+        mode = mode.lower()
+        question_vector = vaults.embeddings.embed_documents([input_text])[0]
+        cached_result = answer_cache.lookup(mode, question_vector, vault_id=vault.vault_id)
+        if cached_result is not None:
+            yield {"type": "sources", "documents": cached_result["documents"]}
+            yield {"type": "token", "content": cached_result["answer"]}
+            yield {"type": "done", "answer": cached_result["answer"], "prompt_tokens": cached_result.get("prompt_tokens")}
+            return
+        
+        prompt_tokens = None
+        streaming_mode = agent.streaming_mode(mode)
+        if streaming_mode is not None:
+            answer_parts = []
+            for event in streaming_mode.stream(input_text, vault):
+                if event["type"] == "sources":
+                    documents = event["documents"]
+                    prompt_tokens = event["prompt_tokens"]
+                    yield {"type": "sources", "documents": format_documents(documents)}
+                else:
+                    answer_parts.append(event["content"])
+                    yield event
+            answer = "".join(answer_parts)
+        else:
+            # The summarize agent only produces its answer at the end of its loop
+            final_state = agent.run(mode, input_text, vault)
+            documents = final_state.get("documents", [])
+            answer = final_state["answer"]
+            yield {"type": "sources", "documents": format_documents(documents)}
+            yield {"type": "token", "content": answer}
+        
+        result = {"answer": answer, "documents": format_documents(documents), "prompt_tokens": prompt_tokens}
+        cache_answer(vault, mode, input_text, question_vector, result, documents, start, generation)
+        yield {"type": "done", "answer": answer, "prompt_tokens": prompt_tokens}
+
+
+def get_rag_stats() -> dict:
+    """Cache hit/miss counters, query expansion decisions, QA prompt sizes, reranking fallbacks and open vaults"""
+    reranker = agent.qa_mode.reranker
+    return {
+        "caches": {
+            "embedding_cache": vaults.embeddings.stats(),
+            "enhancer_cache": enhancer_cache.stats(),
+            "answer_cache": answer_cache.stats()
+        },
+        "query_expansion": agent.qa_mode.stats(),
+        "qa_context": agent.qa_mode.context_stats(),
+        "reranker": reranker.stats() if reranker is not None else None,
+        "vaults": vaults.stats()
+    }
 
 
-def process_uploaded_documents(file_content: bytes, filename: str) -> dict:
-  
+def save_uploaded_vault(file_obj: BinaryIO, filename: str, session_id: str = None) -> dict:
+    """Stream an uploaded vault ZIP to its own upload directory in chunks.
+    
+    Without a `session_id` the upload starts a new vault; with one it re-indexes
+    that session's vault.
+    """
     try:
+        if session_id is None:
+            session_id = str(uuid.uuid4())
+        elif not VAULT_ID_PATTERN.fullmatch(session_id):
+            return {
+                "success": False,
+                "error": f"Invalid session ID: {session_id}",
+                "file_count": 0
+            }
         
         documents_path = Path(DOCUMENTS_DIR)
         documents_path.mkdir(exist_ok=True)
         
-      
-        session_id = str(uuid.uuid4())
-        session_dir = documents_path / session_id
-        session_dir.mkdir(exist_ok=True)
+        # One directory per upload, so uploads to the same vault don't clash
+        upload_dir = documents_path / str(uuid.uuid4())
+        upload_dir.mkdir(exist_ok=True)
         
         
-        temp_file_path = session_dir / filename
+        temp_file_path = upload_dir / Path(filename).name
         with open(temp_file_path, "wb") as buffer:
-            buffer.write(file_content)
-        
-        
-        with zipfile.ZipFile(temp_file_path, 'r') as zip_ref:
-            zip_ref.extractall(session_dir)
-        
-        
-        markdown_files = list(session_dir.rglob("*.md"))
+            shutil.copyfileobj(file_obj, buffer, UPLOAD_CHUNK_SIZE)
         
-        
-        
-        try:
-            new_docs = prepare_parent_docs(str(session_dir))
-            
-            
-            vectorstore.add_documents(new_docs)
-        
-            global parent_docs
-            parent_docs.extend(new_docs)
-            
-    
-            os.unlink(temp_file_path)
-            
-            return {
-                "success": True,
-                "message": f"Successfully processed {len(new_docs)} documents",
-                "file_count": len(markdown_files),
-                "session_id": session_id,
-                "documents_added": len(new_docs)
-            }
-            
-        except Exception as processing_error:
-            
-            shutil.rmtree(session_dir)
-            print(processing_error)
+        if not zipfile.is_zipfile(temp_file_path):
+            shutil.rmtree(upload_dir)
             return {
                 "success": False,
-                "error": f"Error processing documents: {str(processing_error)}",
-                "file_count": len(markdown_files)
+                "error": "Uploaded file is not a valid ZIP archive",
+                "file_count": 0
             }
+        
+        return {
+            "success": True,
+            "session_id": session_id,
+            "zip_path": str(temp_file_path)
+        }
             
     except Exception as e:
         print(e)
@@ -289,28 +757,122 @@ def process_uploaded_documents(file_content: bytes, filename: str) -> dict:
         }
 
 
-def clear_all_documents() -> dict:
+def index_uploaded_vault(session_id: str, zip_path: str, progress: dict = None) -> dict:
+    """Incrementally index a saved vault ZIP into the session's vault, reporting stage and counters into `progress`"""
+    if progress is None:
+        progress = {}
+    upload_dir = Path(zip_path).parent
+    scanned_notes = {}
+    
+    try:
+        progress["stage"] = "waiting for index lock"
+        with vaults.use(session_id, create=True) as vault, vault.write_lock():
+            refresh_if_stale(vault)
+            progress["stage"] = "scanning"
+            manifest = load_manifest(vault.manifest_path)
+            scanned_notes = scan_vault(zip_path)
+            changed, removed = diff_manifest(manifest, scanned_notes)
+            added = [note_path for note_path in changed if note_path not in manifest]
+            progress["notes_total"] = len(changed)
+        
+            progress["stage"] = "removing stale chunks"
+            stale_ids = [
+                chunk_id
+                for note_path in changed + removed
+                for chunk_id in manifest.get(note_path, {}).get("chunk_ids", [])
+            ]
+            if stale_ids:
+                vault.vectorstore.delete(ids=stale_ids)
+                vault.lexical_index.delete(stale_ids)
+        
+            progress["stage"] = "indexing"
+            note_chunk_ids, ingestion_stats = {}, {}
+            if changed:
+                note_chunk_ids, ingestion_stats = index_vault(
+                    vault.vectorstore,
+                    zip_path,
+                    note_paths=changed,
+                    progress=progress,
+                    lexical_index=vault.lexical_index
+                )
+            chunks_added = sum(len(chunk_ids) for chunk_ids in note_chunk_ids.values())
+        
+            progress["stage"] = "saving manifest"
+            for note_path in removed:
+                del manifest[note_path]
+            for note_path in changed:
+                manifest[note_path] = {
+                    **scanned_notes[note_path],
+                    "chunk_ids": note_chunk_ids.get(note_path, [])
+                }
+            save_manifest(vault.manifest_path, manifest)
+            # Bump first: answers finishing after this see the new generation and
+            # aren't cached, and those cached before it are dropped below
+            if changed or removed:
+                vault.changed()
+            if added:
+                # A new note may answer questions whose cached answers never cited it
+                answer_cache.invalidate_vault(vault.vault_id)
+            else:
+                answer_cache.invalidate_notes(changed + removed, vault_id=vault.vault_id)
+        
+        shutil.rmtree(upload_dir)
+        
+        return {
+            "success": True,
+            "message": f"Successfully processed {chunks_added} documents",
+            "file_count": len(scanned_notes),
+            "session_id": session_id,
+            "documents_added": chunks_added,
+            "notes_changed": len(changed),
+            "notes_removed": len(removed),
+            "notes_unchanged": len(scanned_notes) - len(changed),
+            "ingestion_stats": ingestion_stats,
+            "embedding_cache": vaults.embeddings.stats()
+        }
+        
+    except Exception as processing_error:
+        
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        print(processing_error)
+        return {
+            "success": False,
+            "error": f"Error processing documents: {str(processing_error)}",
+            "file_count": len(scanned_notes)
+        }
+
+
+def process_uploaded_documents(file_obj: BinaryIO, filename: str, session_id: str = None) -> dict:
+    """Save and index an uploaded vault ZIP synchronously"""
+    saved = save_uploaded_vault(file_obj, filename, session_id)
+    if not saved["success"]:
+        return saved
+    return index_uploaded_vault(saved["session_id"], saved["zip_path"])
+
+
+def clear_all_documents(session_id: str = None) -> dict:
     """
-    Clear all uploaded documents and reset the retriever.
+    Clear the documents of the vault uploaded under `session_id`, or of the default
+    vault without one, and reset its retrievers.
+    
+    The collection is emptied in place on the already open Chroma client, with no
+    model reload, so queries already running see an empty vault rather than a
+    missing collection. Other vaults are left alone, and so are the
+    embedding and query enhancer caches: they are keyed by content and question,
+    not by what is indexed.
+    
+    Raises:
+        UnknownVault: if no vault was uploaded under `session_id`
     
     Returns:
         dict: Result of the clearing operation
     """
     try:
-        global parent_docs
-        
-        
-        documents_path = Path(DOCUMENTS_DIR)
-        if documents_path.exists():
-            shutil.rmtree(documents_path)
-        
-        documents_path.mkdir(exist_ok=True)
-        
-        
-        parent_docs = []
-        
-        global vectorstore
-        vectorstore = get_vectorstore(CHROMA_DB_PATH)
+        start = time.perf_counter()
+        with vaults.use(session_id) as vault, vault.write_lock():
+            vault.reset()
+            answer_cache.invalidate_vault(vault.vault_id)
+        print(f"Cleared vault {session_id or 'default'} in {(time.perf_counter() - start) * 1000:.0f} ms")
         
         return {
             "success": True,
@@ -318,6 +880,8 @@ def clear_all_documents() -> dict:
             "documents_cleared": True
         }
         
+    except UnknownVault:
+        raise
     except Exception as e:
         return {
             "success": False,
@@ -325,3 +889,31 @@ def clear_all_documents() -> dict:
         }
 
 
+def delete_vault(session_id: str) -> dict:
+    """
+    Delete the vault uploaded under `session_id`: its Chroma collection, BM25
+    index, manifest and cached answers. The default vault cannot be deleted.
+    
+    Raises:
+        UnknownVault: if no vault was uploaded under `session_id`
+    
+    Returns:
+        dict: Result of the deletion
+    """
+    try:
+        vaults.delete(session_id)
+        answer_cache.invalidate_vault(session_id)
+        print(f"Deleted vault {session_id}")
+        
+        return {
+            "success": True,
+            "message": f"Vault {session_id} deleted"
+        }
+        
+    except UnknownVault:
+        raise
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Error deleting vault: {str(e)}"
+        }
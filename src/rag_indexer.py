@@ -1,54 +1,420 @@
-from langchain_community.document_loaders import ObsidianLoader
-import re
-from langchain.schema import Document
-from langchain_text_splitters import  RecursiveCharacterTextSplitter
+import os
+import json
+import time
+import queue
+import atexit
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any
+from pydantic import PrivateAttr
+import chromadb
 from langchain_chroma import Chroma
+from langchain_core.documents import Document
 from langchain_community.embeddings import HuggingFaceEmbeddings
+from embedding_cache import CachedEmbeddings
+from lexical_index import BM25Index
+from note_parser import (
+    clean_obsidian_links,
+    VaultNoteLoader,
+    split_note,
+    new_text_splitter,
+    load_and_split_note
+)
 
 
-def clean_obsidian_links(text):
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# Processes in the sentence-transformers CPU pool; 0 or 1 embeds in-process, where
+# torch already uses every core. Each process holds its own copy of the model.
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "0"))
+# Max batches buffered between two pipeline stages
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+# Processes used to parse, clean and split notes; 0 or 1 parses in-process
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+# Below this many notes the process pool start-up costs more than it saves
+PARALLEL_PARSE_MIN_NOTES = 64
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+DEFAULT_COLLECTION_NAME = "embedded_child_docs"
+# Set to use a shared Chroma server (`chroma run`) instead of opening the store
+# in-process; needed when several backend workers serve the same index
+CHROMA_SERVER_HOST = os.getenv("CHROMA_SERVER_HOST")
+CHROMA_SERVER_PORT = int(os.getenv("CHROMA_SERVER_PORT", "8001"))
 
-    text = re.sub(r'^---\s*\n.*?\n---\s*\n', '', text, flags=re.DOTALL | re.MULTILINE)
-    text = re.sub(r'\[\[([^\]|]+)\|([^\]]+)\]\]', r'\2', text)
-    text = re.sub(r'\[\[([^\]]+)\]\]', r'\1', text)
-    text = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', text)
 
-    return text
+def hash_file(f):
+    """Return the sha256 hex digest of an open binary file, read in blocks"""
+    digest = hashlib.sha256()
+    for block in iter(lambda: f.read(1 << 20), b""):
+        digest.update(block)
+    return digest.hexdigest()
 
-def prepare_parent_docs(obsidian_vault_path):
 
-    loader = ObsidianLoader(obsidian_vault_path, collect_metadata = True)
+def scan_vault(obsidian_vault_path):
+    """Map every note in the vault directory or ZIP (path relative to the vault root) to its content hash and mtime"""
+    notes = {}
+    with VaultNoteLoader(obsidian_vault_path) as loader:
+        for note_path in loader.list_notes():
+            with loader.open_note(note_path) as f:
+                notes[note_path] = {
+                    "hash": hash_file(f),
+                    "mtime": loader.note_mtime(note_path),
+                }
+    return notes
 
-    documents = loader.load()
 
+def load_manifest(manifest_path):
+    """Load the index manifest: note path -> {hash, mtime, chunk_ids}"""
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
 
-    cleaned_documents = []
-    for doc in documents:
-        cleaned_content = clean_obsidian_links(doc.page_content)
-        cleaned_doc = Document(
-            page_content = cleaned_content,
-            metadata = doc.metadata
+
+def save_manifest(manifest_path, manifest):
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def diff_manifest(manifest, scanned_notes):
+    """Return (changed, removed) note paths of a scanned vault compared to the manifest.
+
+    A note is changed when it is new or its content hash differs; mtime alone is not
+    trusted because vault exports and ZIP round-trips reset it.
+    """
+    changed = [
+        note_path for note_path, note in scanned_notes.items()
+        if manifest.get(note_path, {}).get("hash") != note["hash"]
+    ]
+    removed = [note_path for note_path in manifest if note_path not in scanned_notes]
+    return changed, removed
+
+
+def _parse_pool_context():
+    """Start method for the note parsing pool.
+
+    The backend is multithreaded by the time it ingests (query pool, Chroma, torch),
+    and forking a multithreaded process can copy a lock some other thread holds, so
+    workers come from a forkserver instead. It preloads only note_parser, which is all
+    the workers import; the default would re-import the backend's main module. (Under
+    `uvicorn fastapi_backend:app` nothing else is imported; `python fastapi_backend.py`
+    still re-runs that script, minus its __main__ block, in each worker.) Windows has
+    no forkserver and uses spawn.
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["note_parser"])
+    return context
+
+
+def iter_note_chunks(obsidian_vault_path, note_paths=None, parse_workers=PARSE_WORKERS):
+    """Yield the chunk list of each note, fanning notes out over a process pool for large vaults.
+
+    In parallel mode notes are yielded in completion order, with a bounded number
+    of notes in flight so results never pile up in memory.
+    """
+    if parse_workers < 2 or (note_paths is not None and len(note_paths) < PARALLEL_PARSE_MIN_NOTES):
+        text_splitter = new_text_splitter()
+        with VaultNoteLoader(obsidian_vault_path, note_paths=note_paths, collect_metadata = True) as loader:
+            for doc in loader.lazy_load():
+                yield split_note(doc, text_splitter)
+        return
+
+    if note_paths is None:
+        with VaultNoteLoader(obsidian_vault_path) as loader:
+            note_paths = loader.list_notes()
+
+    with ProcessPoolExecutor(max_workers=parse_workers, mp_context=_parse_pool_context()) as executor:
+        pending_paths = iter(note_paths)
+        in_flight = set()
+        max_in_flight = parse_workers * 4
+        while True:
+            for note_path in pending_paths:
+                in_flight.add(executor.submit(load_and_split_note, str(obsidian_vault_path), note_path))
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                return
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+class PooledHuggingFaceEmbeddings(HuggingFaceEmbeddings):
+    """HuggingFaceEmbeddings that fans large batches out over a CPU process pool.
+
+    The pool starts on the first large batch and lives until stop_pool(), which
+    index_vault calls when it finishes. Each worker's torch gets an equal share of
+    the cores instead of a thread per core, so the workers don't oversubscribe them.
+    """
+
+    pool_workers: int = 0
+    _pool: Any = PrivateAttr(default=None)
+    _pool_lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _stop_registered: bool = PrivateAttr(default=False)
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                threads = str(max(1, (os.cpu_count() or 1) // self.pool_workers))
+                thread_vars = ("OMP_NUM_THREADS", "MKL_NUM_THREADS")
+                saved = {name: os.environ.get(name) for name in thread_vars}
+                # The workers are spawned, so they read these when torch loads in them
+                os.environ.update((name, threads) for name in thread_vars)
+                try:
+                    self._pool = self.client.start_multi_process_pool(target_devices=["cpu"] * self.pool_workers)
+                finally:
+                    for name, value in saved.items():
+                        if value is None:
+                            os.environ.pop(name, None)
+                        else:
+                            os.environ[name] = value
+                if not self._stop_registered:
+                    atexit.register(self.stop_pool)
+                    self._stop_registered = True
+            return self._pool
+
+    def stop_pool(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self.client.stop_multi_process_pool(self._pool)
+                self._pool = None
+
+    def embed_documents(self, texts):
+        batch_size = self.encode_kwargs.get("batch_size", 32)
+        # A single encode batch can't be shared out, and a query is faster in-process
+        if self.pool_workers < 2 or len(texts) <= batch_size:
+            return super().embed_documents(texts)
+
+        texts = [text.replace("\n", " ") for text in texts]
+        # One chunk per worker, so every process gets a share of the call
+        chunk_size = -(-len(texts) // self.pool_workers)
+        embeddings = self.client.encode_multi_process(
+            texts, self._get_pool(), batch_size=batch_size, chunk_size=chunk_size
         )
-        cleaned_documents.append(cleaned_doc)
-    
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size = 1000, chunk_overlap=100)
-    
-    split_chunks = text_splitter.split_documents(cleaned_documents)
-    for chunk in split_chunks:
-        source =  chunk.metadata['source'].strip('.md')
-        chunk.page_content = source + "\n\n" + chunk.page_content
+        return embeddings.tolist()
 
-    
-    return split_chunks
+
+_STAGE_DONE = object()
+
+
+def _put(stage_queue, item, stop_event):
+    """Put on a bounded queue without deadlocking if another stage has failed"""
+    while not stop_event.is_set():
+        try:
+            stage_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
 
 
-def get_vectorstore(vectorstore_dir):
+def _get(stage_queue, stop_event):
+    while not stop_event.is_set():
+        try:
+            return stage_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _STAGE_DONE
 
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+
+def index_vault(vectorstore, obsidian_vault_path, note_paths=None, batch_size=EMBED_BATCH_SIZE,
+                parse_workers=PARSE_WORKERS, queue_size=PIPELINE_QUEUE_SIZE, progress=None,
+                lexical_index=None, embed_workers=EMBED_WORKERS):
+    """Parse -> embed -> write the vault's notes into the vector store.
+
+    Each stage runs in its own thread and hands work to the next through a bounded
+    queue, so parsing and writing overlap with embedding and memory stays bounded.
+    Parsing (load, clean, split) fans out over `parse_workers` processes. Chunks
+    are embedded `batch_size * embed_workers` at a time, so one call keeps every
+    embedding process busy, and written in batches of `batch_size`. If given, the
+    `progress` dict's notes_processed / chunks_embedded / chunks_written counters
+    are updated as the stages advance. If given, `lexical_index` receives every
+    chunk written to the vector store, under the same ID.
+
+    Returns:
+        tuple: (note path -> written chunk IDs, per-stage throughput stats)
+    """
+    embeddings = vectorstore.embeddings
+    embed_call_size = batch_size * max(1, embed_workers)
+
+    chunks_queue = queue.Queue(maxsize=queue_size)
+    embedded_queue = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    errors = []
+    stats = {stage: {"items": 0, "seconds": 0.0} for stage in ("parse", "embed", "write")}
+    notes_parsed = 0
+    note_chunk_ids = {}
+    if progress is None:
+        progress = {}
+    progress.update(notes_processed=0, chunks_embedded=0, chunks_written=0)
+
+    def timed(stage, items, start):
+        stats[stage]["items"] += items
+        stats[stage]["seconds"] += time.perf_counter() - start
+
+    def run_stage(stage_fn, output_queue):
+        try:
+            stage_fn()
+        except Exception as e:
+            errors.append(e)
+            stop_event.set()
+        finally:
+            if output_queue is not None:
+                _put(output_queue, _STAGE_DONE, stop_event)
+
+    def parse_stage():
+        nonlocal notes_parsed
+        notes = iter_note_chunks(obsidian_vault_path, note_paths, parse_workers)
+        batch = []
+        while not stop_event.is_set():
+            start = time.perf_counter()
+            chunks = next(notes, None)
+            if chunks is None:
+                break
+            timed("parse", len(chunks), start)
+            notes_parsed += 1
+            progress["notes_processed"] = notes_parsed
+            batch.extend(chunks)
+            while len(batch) >= embed_call_size:
+                if not _put(chunks_queue, batch[:embed_call_size], stop_event):
+                    notes.close()
+                    return
+                batch = batch[embed_call_size:]
+        notes.close()
+        if batch:
+            _put(chunks_queue, batch, stop_event)
+
+    def embed_stage():
+        while True:
+            batch = _get(chunks_queue, stop_event)
+            if batch is _STAGE_DONE:
+                return
+            start = time.perf_counter()
+            vectors = embeddings.embed_documents([chunk.page_content for chunk in batch])
+            timed("embed", len(batch), start)
+            progress["chunks_embedded"] += len(batch)
+            if not _put(embedded_queue, (batch, vectors), stop_event):
+                return
+
+    def write_stage():
+        while True:
+            item = _get(embedded_queue, stop_event)
+            if item is _STAGE_DONE:
+                return
+            chunks, chunk_vectors = item
+            for offset in range(0, len(chunks), batch_size):
+                batch = chunks[offset:offset + batch_size]
+                vectors = chunk_vectors[offset:offset + batch_size]
+                start = time.perf_counter()
+                vectorstore._collection.upsert(
+                    ids=[chunk.id for chunk in batch],
+                    embeddings=vectors,
+                    documents=[chunk.page_content for chunk in batch],
+                    metadatas=[chunk.metadata for chunk in batch],
+                )
+                if lexical_index is not None:
+                    lexical_index.add(batch)
+                timed("write", len(batch), start)
+                for chunk in batch:
+                    note_chunk_ids.setdefault(chunk.metadata["note_path"], []).append(chunk.id)
+                progress["chunks_written"] += len(batch)
+
+    threads = [
+        threading.Thread(target=run_stage, args=(parse_stage, chunks_queue), daemon=True),
+        threading.Thread(target=run_stage, args=(embed_stage, embedded_queue), daemon=True),
+        threading.Thread(target=run_stage, args=(write_stage, None), daemon=True),
+    ]
+    pipeline_start = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        # Don't keep the pool's model copies in memory between uploads
+        model = getattr(embeddings, "embeddings", embeddings)
+        if isinstance(model, PooledHuggingFaceEmbeddings):
+            model.stop_pool()
+    total_seconds = time.perf_counter() - pipeline_start
+
+    if errors:
+        raise errors[0]
+
+    for stage, stage_stats in stats.items():
+        stage_stats["per_second"] = round(stage_stats["items"] / stage_stats["seconds"], 1) if stage_stats["seconds"] else 0.0
+        stage_stats["seconds"] = round(stage_stats["seconds"], 3)
+    stats["total_seconds"] = round(total_seconds, 3)
+    stats["notes"] = notes_parsed
+    print(
+        f"Indexed {stats['write']['items']} chunks from {notes_parsed} notes in {total_seconds:.1f}s "
+        + " | ".join(f"{stage}: {stats[stage]['per_second']} chunks/s" for stage in ("parse", "embed", "write"))
+    )
+
+    return note_chunk_ids, stats
+
+
+def get_embeddings(vectorstore_dir):
+    """Load the embedding model, behind the on-disk embedding cache kept next to the store"""
+    os.makedirs(vectorstore_dir, exist_ok=True)
+    return CachedEmbeddings(
+        PooledHuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL_NAME,
+            encode_kwargs={"batch_size": EMBED_BATCH_SIZE},
+            pool_workers=EMBED_WORKERS
+        ),
+        cache_path=os.path.join(vectorstore_dir, "embedding_cache.sqlite3"),
+        model_name=EMBEDDING_MODEL_NAME,
+        max_entries=EMBED_CACHE_MAX_ENTRIES
+    )
+
+
+def get_chroma_client(vectorstore_dir):
+    if CHROMA_SERVER_HOST:
+        return chromadb.HttpClient(host=CHROMA_SERVER_HOST, port=CHROMA_SERVER_PORT)
+    os.makedirs(vectorstore_dir, exist_ok=True)
+    return chromadb.PersistentClient(path=vectorstore_dir)
+
+
+def get_vectorstore(vectorstore_dir, embeddings=None, client=None, collection_name=DEFAULT_COLLECTION_NAME):
+    """Open a chunk collection, reusing an already loaded model and client when given"""
+    if embeddings is None:
+        embeddings = get_embeddings(vectorstore_dir)
+    if client is None:
+        client = get_chroma_client(vectorstore_dir)
     vectorstore = Chroma(
-        collection_name="embedded_child_docs",
+        collection_name=collection_name,
         embedding_function = embeddings,
-        persist_directory = vectorstore_dir
+        client = client
     )
     
-    return vectorstore
\ No newline at end of file
+    return vectorstore
+
+
+def get_lexical_index(vectorstore_dir):
+    os.makedirs(vectorstore_dir, exist_ok=True)
+    return BM25Index(os.path.join(vectorstore_dir, "lexical_index.sqlite3"))
+
+
+def sync_lexical_index(vectorstore, lexical_index, batch_size=1000):
+    """Backfill an empty lexical index from a vector store indexed before it existed"""
+    collection = vectorstore._collection
+    if len(lexical_index) or not collection.count():
+        return 0
+    added = 0
+    while True:
+        batch = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=added)
+        if not batch["ids"]:
+            break
+        lexical_index.add([
+            Document(id=chunk_id, page_content=content, metadata=metadata or {})
+            for chunk_id, content, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"])
+        ])
+        added += len(batch["ids"])
+    print(f"Backfilled the lexical index with {added} chunks")
+    return added
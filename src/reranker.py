@@ -0,0 +1,83 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from retrieval import estimate_tokens
+
+
+class CrossEncoderReranker:
+    """Re-orders retrieved chunks with a small local cross-encoder, within a time budget.
+
+    Query/chunk pairs are scored on the CPU in batches of `batch_size`, on one of
+    `workers` scoring threads. If scoring has not finished within `time_budget`
+    seconds, the caller stops waiting and the chunks keep their retrieval order;
+    the abandoned scoring stops after its current batch. Either way, at most
+    `top_n` chunks totalling `token_budget` estimated tokens are kept.
+    """
+
+    def __init__(self, model_name, top_n=6, token_budget=2000, time_budget=0.3, batch_size=16, workers=4):
+        from sentence_transformers import CrossEncoder
+        
+        self.model = CrossEncoder(model_name, device="cpu")
+        self.top_n = top_n
+        self.token_budget = token_budget
+        self.time_budget = time_budget
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rerank")
+        self._lock = threading.Lock()
+        self.reranked = 0
+        self.fallbacks = 0
+        self.seconds = 0.0
+
+    def _within_budget(self, documents):
+        kept = []
+        tokens = 0
+        for doc in documents[:self.top_n]:
+            doc_tokens = estimate_tokens(doc.page_content)
+            if kept and tokens + doc_tokens > self.token_budget:
+                break
+            kept.append(doc)
+            tokens += doc_tokens
+        return kept
+
+    def _score(self, query, documents, abandoned):
+        scores = []
+        for i in range(0, len(documents), self.batch_size):
+            if abandoned.is_set():
+                return None
+            batch = documents[i:i + self.batch_size]
+            scores.extend(self.model.predict([(query, doc.page_content) for doc in batch], batch_size=self.batch_size))
+        return scores
+
+    def rerank(self, query, documents):
+        start = time.perf_counter()
+        abandoned = threading.Event()
+        # Waiting for a free scoring thread counts against the budget too
+        future = self._executor.submit(self._score, query, documents, abandoned)
+        try:
+            scores = future.result(timeout=self.time_budget)
+        except TimeoutError:
+            abandoned.set()
+            scores = None
+        elapsed = time.perf_counter() - start
+        
+        fallback = scores is None
+        if fallback:
+            print(f"Reranking exceeded {self.time_budget * 1000:.0f} ms budget, keeping retrieval order")
+            ranked = documents
+        else:
+            order = sorted(range(len(documents)), key=lambda i: scores[i], reverse=True)
+            ranked = [documents[i] for i in order]
+        
+        with self._lock:
+            self.reranked += 1
+            self.fallbacks += fallback
+            self.seconds += elapsed
+        return self._within_budget(ranked)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "reranked": self.reranked,
+                "fallbacks": self.fallbacks,
+                "avg_ms": round(self.seconds / self.reranked * 1000, 1) if self.reranked else 0.0
+            }
@@ -0,0 +1,70 @@
+from langchain_core.documents import Document
+
+
+RRF_K = 60
+# Rough characters per token for English notes, for budgeting prompt size
+CHARS_PER_TOKEN = 4
+
+
+def multi_query_search(vectorstore, queries, k=6):
+    """Embed all queries in one batched call and search them in one Chroma query.
+
+    Returns one ranked list of (Document, distance) per query.
+    """
+    if not queries:
+        return []
+    # MiniLM embeds queries and documents identically, so the batched document
+    # path (and its cache) can embed the queries in a single model call
+    query_embeddings = vectorstore.embeddings.embed_documents(queries)
+    results = vectorstore._collection.query(
+        query_embeddings=query_embeddings,
+        n_results=k,
+        include=["documents", "metadatas", "distances"]
+    )
+    ranked_lists = []
+    for ids, contents, metadatas, distances in zip(
+        results["ids"], results["documents"], results["metadatas"], results["distances"]
+    ):
+        ranked_lists.append([
+            (Document(id=doc_id, page_content=content, metadata=metadata or {}), distance)
+            for doc_id, content, metadata, distance in zip(ids, contents, metadatas, distances)
+        ])
+    return ranked_lists
+
+
+def distance_to_similarity(distance):
+    """Cosine similarity from a Chroma distance.
+
+    The collection uses Chroma's default squared-L2 space and MiniLM vectors are
+    unit-normalized, so distance = 2 - 2 * cosine.
+    """
+    return 1.0 - distance / 2.0
+
+
+def is_confident(ranked, min_top_similarity, min_mean_similarity, top_n=3):
+    """Whether a single search's (Document, distance) ranking looks good enough on its own"""
+    if not ranked:
+        return False
+    similarities = [distance_to_similarity(distance) for _, distance in ranked[:top_n]]
+    return similarities[0] >= min_top_similarity and sum(similarities) / len(similarities) >= min_mean_similarity
+
+
+def reciprocal_rank_fusion(ranked_lists, rrf_k=RRF_K):
+    """Fuse several ranked (Document, score) lists into one list of Documents.
+
+    Each document scores sum(1 / (rrf_k + rank)) over the lists it appears in, so
+    chunks ranked well by several sub-queries rise to the top.
+    """
+    scores = {}
+    docs = {}
+    for ranked in ranked_lists:
+        for rank, (doc, _) in enumerate(ranked, 1):
+            doc_id = doc.id or doc.page_content.strip()
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(doc_id, doc)
+    return [docs[doc_id] for doc_id in sorted(scores, key=scores.get, reverse=True)]
+
+
+def estimate_tokens(text):
+    """Approximate LLM token count of a text, without loading a tokenizer"""
+    return len(text) // CHARS_PER_TOKEN + 1
@@ -0,0 +1,207 @@
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from rag_indexer import (
+    get_vectorstore,
+    get_lexical_index,
+    sync_lexical_index,
+    save_manifest,
+    DEFAULT_COLLECTION_NAME
+)
+from chromadb.errors import NotFoundError
+from index_state import IndexGeneration, index_write_lock
+
+
+# Chunk IDs deleted per request when a vault is cleared
+RESET_BATCH_SIZE = 5000
+# Session IDs name directories and Chroma collections, so keep them to safe characters
+VAULT_ID_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]{0,62}[A-Za-z0-9]")
+
+
+class UnknownVault(Exception):
+    """Raised for a session ID that has no indexed vault"""
+
+
+class VaultIndex:
+    """Everything indexed for one vault: its Chroma collection, BM25 index, manifest
+    and index generation, all kept under `directory`.
+    """
+
+    def __init__(self, vault_id, directory, collection_name, embeddings, client):
+        os.makedirs(directory, exist_ok=True)
+        self.vault_id = vault_id
+        self.directory = directory
+        self.collection_name = collection_name
+        self.manifest_path = os.path.join(directory, "index_manifest.json")
+        self.lock_path = os.path.join(directory, "index.lock")
+        self.generation = IndexGeneration(os.path.join(directory, "index_generation"))
+        # Read first, so a change made while we open is picked up by the next refresh
+        self.seen_generation = self.generation.read()
+        self.vectorstore = get_vectorstore(directory, embeddings=embeddings, client=client, collection_name=collection_name)
+        self.lexical_index = get_lexical_index(directory)
+        if not len(self.lexical_index) and self.vectorstore._collection.count():
+            # Every worker opening the vault sees the empty index; only one backfills it
+            with self.write_lock():
+                self.lexical_index.reload()
+                sync_lexical_index(self.vectorstore, self.lexical_index)
+        self.in_use = 0
+        self.last_used = time.time()
+        self.deleted = False
+        self._refresh_lock = threading.Lock()
+
+    def write_lock(self):
+        """Cross-process lock held while changing this vault's index"""
+        return index_write_lock(self.lock_path)
+
+    def changed(self):
+        """Record a change to the index so other workers refresh; call under write_lock()"""
+        self.seen_generation = self.generation.bump()
+
+    def refresh_if_stale(self):
+        """Pick up re-index and clear events made by other backend workers; True if refreshed"""
+        generation = self.generation.read()
+        if generation == self.seen_generation:
+            return False
+        with self._refresh_lock:
+            if generation == self.seen_generation:
+                return False
+            # Chroma reads the shared collection on every query and reset() empties it
+            # in place, so only the BM25 statistics held in memory need reloading
+            self.lexical_index.reload()
+            self.seen_generation = generation
+            return True
+
+    def reset(self):
+        """Empty the collection, BM25 index and manifest; call under write_lock().
+
+        The collection is emptied in place rather than dropped, so queries already
+        running here or in another worker keep a valid (now empty) collection.
+        """
+        collection = self.vectorstore._collection
+        while True:
+            ids = collection.get(limit=RESET_BATCH_SIZE, include=[])["ids"]
+            if not ids:
+                break
+            collection.delete(ids=ids)
+        self.lexical_index.clear()
+        save_manifest(self.manifest_path, {})
+        self.changed()
+
+    def close(self):
+        self.lexical_index.close()
+
+
+class VaultRegistry:
+    """Opens each uploaded vault's index on demand and keeps recently used ones in memory.
+
+    The index built before vaults had their own collections is the default vault,
+    at the root of `base_dir`, and serves requests without a session ID. Other vaults
+    live under `base_dir/vaults/<session ID>`. Beyond `max_open` vaults, or after
+    `idle_seconds` without a request, the least recently used vaults that no request
+    is using are closed; they are reopened from disk when next queried.
+
+    Closing a vault only releases its BM25 connection and this worker's handles on
+    it. It frees no vector memory: Chroma keeps each queried collection's HNSW
+    index in its own LRU cache (sized by the open file limit, not by memory) and
+    has no call to unload one.
+    """
+
+    def __init__(self, base_dir, embeddings, client, max_open=8, idle_seconds=1800):
+        self.base_dir = base_dir
+        self.embeddings = embeddings
+        self.client = client
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self.default = VaultIndex(None, base_dir, DEFAULT_COLLECTION_NAME, embeddings, client)
+        self._vaults = OrderedDict()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.closed = 0
+
+    def vault_dir(self, vault_id):
+        if not VAULT_ID_PATTERN.fullmatch(vault_id):
+            raise UnknownVault(f"Invalid session ID: {vault_id}")
+        return os.path.join(self.base_dir, "vaults", vault_id)
+
+    def _open(self, vault_id, create):
+        directory = self.vault_dir(vault_id)
+        vault = self._vaults.get(vault_id)
+        if vault is not None and not create and not os.path.isdir(directory):
+            # Deleted by another worker since we opened it
+            self._vaults.pop(vault_id).close()
+            self.closed += 1
+            vault = None
+        if vault is None:
+            if not create and not os.path.isdir(directory):
+                raise UnknownVault(f"No vault uploaded for session {vault_id}")
+            vault = VaultIndex(vault_id, directory, f"vault-{vault_id}", self.embeddings, self.client)
+            self._vaults[vault_id] = vault
+            self.opened += 1
+        self._vaults.move_to_end(vault_id)
+        return vault
+
+    def _evict(self):
+        now = time.time()
+        idle = [
+            vault_id for vault_id, vault in self._vaults.items()
+            if vault.in_use == 0 and now - vault.last_used > self.idle_seconds
+        ]
+        for vault_id, vault in self._vaults.items():
+            if len(self._vaults) - len(idle) <= self.max_open:
+                break
+            if vault.in_use == 0 and vault_id not in idle:
+                idle.append(vault_id)
+        for vault_id in idle:
+            self._vaults.pop(vault_id).close()
+            self.closed += 1
+
+    @contextmanager
+    def use(self, vault_id=None, create=False):
+        """The vault for a session ID (or the default vault), kept open while in use"""
+        if vault_id is None:
+            yield self.default
+            return
+        with self._lock:
+            vault = self._open(vault_id, create)
+            vault.in_use += 1
+        try:
+            yield vault
+        finally:
+            with self._lock:
+                vault.in_use -= 1
+                vault.last_used = time.time()
+                if vault.deleted and vault.in_use == 0:
+                    vault.close()
+                self._evict()
+
+    def delete(self, vault_id):
+        """Drop a session's Chroma collection and remove its directory"""
+        directory = self.vault_dir(vault_id)
+        if not os.path.isdir(directory):
+            raise UnknownVault(f"No vault uploaded for session {vault_id}")
+        with index_write_lock(os.path.join(directory, "index.lock")):
+            with self._lock:
+                vault = self._vaults.pop(vault_id, None)
+                if vault is not None:
+                    self.closed += 1
+                    vault.deleted = True
+                    if vault.in_use == 0:
+                        vault.close()
+            try:
+                self.client.delete_collection(f"vault-{vault_id}")
+            except NotFoundError:
+                pass
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open_vaults": len(self._vaults),
+                "max_open": self.max_open,
+                "opened": self.opened,
+                "closed": self.closed
+            }
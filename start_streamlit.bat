@@ -8,8 +8,10 @@ call kill_port_8000.bat
 echo Starting FastAPI Backend...
 start "FastAPI Backend" cmd /k "cd /d %~dp0\src && python fastapi_backend.py"
 
-echo Waiting for backend to start...
-timeout /t 3 /nobreak > nul
+echo Waiting for backend to load models and stores...
+:wait_ready
+timeout /t 1 /nobreak > nul
+curl -s -f http://localhost:8000/ready > nul 2>&1 || goto wait_ready
 
 echo Starting Streamlit Frontend...
 start "Streamlit Frontend" cmd /k "cd /d %~dp0 && streamlit run streamlit_app.py"
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 """
 Start script for RAG Agent with Streamlit frontend
+
+Supervises both services: the backend is started first and the frontend only
+once the backend reports ready, and either one is restarted if it crashes.
 """
 import subprocess
 import sys
@@ -8,35 +11,66 @@ import time
 import os
 import platform
 from pathlib import Path
+import requests
+
+BACKEND_PORT = int(os.getenv("BACKEND_PORT", "8000"))
+BACKEND_WORKERS = int(os.getenv("BACKEND_WORKERS", "1"))
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "300"))
+# Restarts allowed per service within RESTART_WINDOW seconds before giving up
+MAX_RESTARTS = int(os.getenv("MAX_RESTARTS", "5"))
+RESTART_WINDOW = 300
+READY_URL = f"http://localhost:{BACKEND_PORT}/ready"
+# Several workers can't open the same on-disk Chroma store safely, so they share a Chroma server
+CHROMA_SERVER_PORT = int(os.getenv("CHROMA_SERVER_PORT", "8001"))
+USE_CHROMA_SERVER = BACKEND_WORKERS > 1 and not os.getenv("CHROMA_SERVER_HOST")
+CHROMA_HEARTBEAT_URL = f"http://localhost:{CHROMA_SERVER_PORT}/api/v2/heartbeat"
+CHROMA_DB_PATH = Path(__file__).parent / "chroma_db"
 
 def kill_port_8000():
-    """Kill any existing processes on port 8000"""
-    print("🔍 Checking for existing processes on port 8000...")
+    """Kill any existing processes on the backend port"""
+    print(f"🔍 Checking for existing processes on port {BACKEND_PORT}...")
     try:
         if platform.system() == "Windows":
-            # Find processes using port 8000
+            # Find processes using the backend port
             result = subprocess.run(['netstat', '-ano'], capture_output=True, text=True)
             lines = result.stdout.split('\n')
             for line in lines:
-                if ':8000' in line and 'LISTENING' in line:
+                if f':{BACKEND_PORT}' in line and 'LISTENING' in line:
                     parts = line.split()
                     if len(parts) >= 5:
                         pid = parts[-1]
-                        print(f"🔪 Killing process {pid} on port 8000...")
+                        print(f"🔪 Killing process {pid} on port {BACKEND_PORT}...")
                         subprocess.run(['taskkill', '/PID', pid, '/F'], capture_output=True)
         else:
-            # For Unix-like systems
-            subprocess.run(['pkill', '-f', 'fastapi_backend.py'], capture_output=True)
-        print("✅ Port 8000 is now free")
+            # For Unix-like systems; matches both `python fastapi_backend.py` and `uvicorn fastapi_backend:app`
+            subprocess.run(['pkill', '-f', 'fastapi_backend'], capture_output=True)
+        print(f"✅ Port {BACKEND_PORT} is now free")
     except Exception as e:
-        print(f"⚠️  Could not check/kill port 8000 processes: {e}")
+        print(f"⚠️  Could not check/kill port {BACKEND_PORT} processes: {e}")
+
+def start_chroma():
+    """Start the Chroma server shared by the backend workers"""
+    print(f"🗄️  Starting Chroma server on port {CHROMA_SERVER_PORT}...")
+    chroma_process = subprocess.Popen([
+        sys.executable, "-c",
+        "import sys; from chromadb.cli.cli import app; sys.argv[0] = 'chroma'; app()",
+        "run", "--path", str(CHROMA_DB_PATH), "--host", "localhost", "--port", str(CHROMA_SERVER_PORT)
+    ])
+    return chroma_process
 
 def start_backend():
     """Start the FastAPI backend"""
-    print("🚀 Starting FastAPI Backend...")
+    print(f"🚀 Starting FastAPI Backend ({BACKEND_WORKERS} worker{'s' if BACKEND_WORKERS != 1 else ''})...")
+    env = dict(os.environ)
+    if USE_CHROMA_SERVER:
+        env["CHROMA_SERVER_HOST"] = "localhost"
+        env["CHROMA_SERVER_PORT"] = str(CHROMA_SERVER_PORT)
     backend_process = subprocess.Popen([
-        sys.executable, "fastapi_backend.py"
-    ], cwd=Path(__file__).parent / "src")
+        sys.executable, "-m", "uvicorn", "fastapi_backend:app",
+        "--host", "0.0.0.0",
+        "--port", str(BACKEND_PORT),
+        "--workers", str(BACKEND_WORKERS)
+    ], cwd=Path(__file__).parent / "src", env=env)
     return backend_process
 
 def start_streamlit():
@@ -47,43 +81,168 @@ def start_streamlit():
     ], cwd=Path(__file__).parent)
     return streamlit_process
 
+def wait_for_chroma(chroma_proc, timeout=60):
+    """Poll the Chroma server's heartbeat with backoff until it answers"""
+    start = time.perf_counter()
+    delay = 0.25
+    while True:
+        if chroma_proc.poll() is not None:
+            raise RuntimeError(f"Chroma server exited with code {chroma_proc.returncode} during startup")
+        try:
+            if requests.get(CHROMA_HEARTBEAT_URL, timeout=2).status_code == 200:
+                return time.perf_counter() - start
+        except requests.exceptions.RequestException:
+            pass
+        if time.perf_counter() - start > timeout:
+            raise RuntimeError(f"Chroma server was not up after {timeout:.0f}s")
+        time.sleep(delay)
+        delay = min(delay * 2, 5.0)
+
+def wait_for_backend(backend_proc, timeout=READY_TIMEOUT):
+    """Poll the backend's readiness endpoint with backoff until every worker is ready.
+
+    Each worker loads its models separately and a poll reaches whichever worker
+    accepts it, so one 200 only says that worker is ready. This waits until
+    BACKEND_WORKERS distinct worker pids have answered 200.
+
+    Returns the seconds it took, or raises if the backend exits, fails to start
+    or is not ready within `timeout` seconds.
+    """
+    print("⏳ Waiting for backend to load models and stores...")
+    start = time.perf_counter()
+    delay = 0.25
+    ready_pids = set()
+    while True:
+        if backend_proc.poll() is not None:
+            raise RuntimeError(f"Backend exited with code {backend_proc.returncode} during startup")
+        try:
+            response = requests.get(READY_URL, timeout=2)
+            if response.status_code == 200:
+                ready_pids.add(response.json().get("pid"))
+                if len(ready_pids) >= BACKEND_WORKERS:
+                    return time.perf_counter() - start
+                # The rest are usually close behind; poll quickly for them
+                delay = 0.1
+            else:
+                detail = response.json().get("detail")
+                if isinstance(detail, dict) and detail.get("error"):
+                    raise RuntimeError(f"Backend failed to start: {detail['error']}")
+        except requests.exceptions.RequestException:
+            # Not listening yet
+            pass
+        if time.perf_counter() - start > timeout:
+            raise RuntimeError(
+                f"Backend was not ready after {timeout:.0f}s "
+                f"({len(ready_pids)} of {BACKEND_WORKERS} workers ready)"
+            )
+        time.sleep(delay)
+        delay = min(delay * 2, 5.0)
+
+def stop(process):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+class Restarts:
+    """Restart times of one service, to stop restarting a service that keeps crashing"""
+    def __init__(self, name):
+        self.name = name
+        self.times = []
+
+    def allow(self):
+        now = time.time()
+        self.times = [t for t in self.times if now - t < RESTART_WINDOW]
+        if len(self.times) >= MAX_RESTARTS:
+            print(f"❌ {self.name} crashed {len(self.times)} times in {RESTART_WINDOW}s, giving up")
+            return False
+        self.times.append(now)
+        # Back off a little more on every crash in the window
+        time.sleep(min(2 ** (len(self.times) - 1), 30))
+        return True
+
+def supervise(processes):
+    """Restart whichever service exits, until Ctrl+C or too many crashes.
+
+    `processes` maps "chroma"/"backend"/"streamlit" to their current process and
+    is updated in place, so the caller can always stop the live ones.
+    """
+    chroma_restarts = Restarts("Chroma server")
+    backend_restarts = Restarts("Backend")
+    streamlit_restarts = Restarts("Streamlit")
+    while True:
+        time.sleep(1)
+        if "chroma" in processes and processes["chroma"].poll() is not None:
+            print(f"💥 Chroma server exited with code {processes['chroma'].returncode}")
+            if not chroma_restarts.allow():
+                return
+            processes["chroma"] = start_chroma()
+            try:
+                print(f"✅ Chroma server up again in {wait_for_chroma(processes['chroma']):.1f}s")
+            except RuntimeError as e:
+                print(f"⚠️  {e}")
+        if processes["backend"].poll() is not None:
+            print(f"💥 Backend exited with code {processes['backend'].returncode}")
+            if not backend_restarts.allow():
+                return
+            kill_port_8000()
+            processes["backend"] = start_backend()
+            try:
+                print(f"✅ Backend ready again in {wait_for_backend(processes['backend']):.1f}s")
+            except RuntimeError as e:
+                print(f"⚠️  {e}")
+        if processes["streamlit"].poll() is not None:
+            print(f"💥 Streamlit exited with code {processes['streamlit'].returncode}")
+            if not streamlit_restarts.allow():
+                return
+            processes["streamlit"] = start_streamlit()
+
 def main():
     print("=" * 50)
     print("📚 RAG Agent - Streamlit Frontend")
     print("=" * 50)
-    
+
+    processes = {}
+    exit_code = 1
     try:
-        # Kill any existing processes on port 8000
+        start = time.perf_counter()
+
+        # Kill any existing processes on the backend port
         kill_port_8000()
-        
-        # Start backend
-        backend_proc = start_backend()
-        
-        # Wait a bit for backend to start
-        print("⏳ Waiting for backend to initialize...")
-        time.sleep(3)
-        
+
+        if USE_CHROMA_SERVER:
+            processes["chroma"] = start_chroma()
+            print(f"✅ Chroma server up in {wait_for_chroma(processes['chroma']):.1f}s")
+
+        # Start backend and wait until it can actually answer queries
+        processes["backend"] = start_backend()
+        ready_seconds = wait_for_backend(processes["backend"])
+        print(f"✅ Backend ready in {ready_seconds:.1f}s")
+
         # Start Streamlit
-        streamlit_proc = start_streamlit()
-        
-        print("\n✅ Services started successfully!")
-        print("🔗 FastAPI Backend: http://localhost:8000")
+        processes["streamlit"] = start_streamlit()
+
+        print(f"\n✅ Services started successfully in {time.perf_counter() - start:.1f}s!")
+        print(f"🔗 FastAPI Backend: http://localhost:{BACKEND_PORT}")
         print("🔗 Streamlit Frontend: http://localhost:8501")
         print("\n📝 Press Ctrl+C to stop both services")
-        
-        # Wait for processes
-        try:
-            backend_proc.wait()
-            streamlit_proc.wait()
-        except KeyboardInterrupt:
-            print("\n🛑 Stopping services...")
-            backend_proc.terminate()
-            streamlit_proc.terminate()
-            print("✅ Services stopped")
-            
+
+        supervise(processes)
+
+    except KeyboardInterrupt:
+        print("\n🛑 Stopping services...")
+        exit_code = 0
     except Exception as e:
         print(f"❌ Error starting services: {e}")
-        sys.exit(1)
+    finally:
+        for process in reversed(list(processes.values())):
+            stop(process)
+        print("✅ Services stopped")
+
+    # Without Ctrl+C we only get here when a service could not be kept running
+    sys.exit(exit_code)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,10 +1,14 @@
 import streamlit as st
 import requests
 import json
+import time
 from typing import List, Dict
 
 # Configuration
 BACKEND_URL = "http://localhost:8000"
+JOB_POLL_INTERVAL = 1.0
+# Stop waiting for an ingestion job after this long, whatever the backend reports
+JOB_TIMEOUT = 3600
 
 # Page configuration
 st.set_page_config(
@@ -288,12 +292,20 @@ def initialize_session_state():
         st.session_state.current_page = 'upload'
     if 'selected_mode' not in st.session_state:
         st.session_state.selected_mode = 'qa'
+    if 'vault_session_id' not in st.session_state:
+        # Set by the first upload and kept in the page URL (?vault=), so a reload or
+        # a bookmark reopens the same vault; queries and clears only touch that vault
+        st.session_state.vault_session_id = st.query_params.get("vault")
+        if st.session_state.vault_session_id:
+            st.session_state.documents_uploaded = True
+            st.session_state.current_page = 'chat'
 
 def upload_vault(uploaded_file):
     """Upload Obsidian vault to backend"""
     try:
         files = {"file": (uploaded_file.name, uploaded_file.getvalue(), "application/zip")}
-        response = requests.post(f"{BACKEND_URL}/upload-vault", files=files)
+        data = {"session_id": st.session_state.vault_session_id} if st.session_state.vault_session_id else {}
+        response = requests.post(f"{BACKEND_URL}/upload-vault", files=files, data=data)
         
         if response.status_code == 200:
             result = response.json()
@@ -306,25 +318,68 @@ def upload_vault(uploaded_file):
     except Exception as e:
         return False, {"error": str(e)}
 
-def query_rag(query: str, mode: str):
-    """Send query to RAG backend"""
+def get_job_status(job_id: str):
+    """Fetch the progress of a background ingestion job"""
     try:
-        payload = {"query": query, "mode": mode}
-        response = requests.post(f"{BACKEND_URL}/rag_query", json=payload)
-        
+        response = requests.get(f"{BACKEND_URL}/jobs/{job_id}")
         if response.status_code == 200:
             return True, response.json()
         else:
-            return False, {"error": "Failed to get response from backend"}
+            return False, {"error": response.json().get("detail", "Unknown job")}
     except requests.exceptions.ConnectionError:
-        return False, {"error": "Cannot connect to backend. Make sure the FastAPI server is running on port 8000."}
+        return False, {"error": "Cannot connect to backend"}
     except Exception as e:
         return False, {"error": str(e)}
 
+def wait_for_ingestion(job_id: str):
+    """Poll an ingestion job until it finishes, showing its progress"""
+    progress_bar = st.progress(0.0, text="⏳ Waiting for indexing to start...")
+    deadline = time.monotonic() + JOB_TIMEOUT
+    while True:
+        if time.monotonic() > deadline:
+            progress_bar.empty()
+            return False, {"error": f"Indexing did not finish within {JOB_TIMEOUT // 60} minutes"}
+        success, job = get_job_status(job_id)
+        if not success:
+            progress_bar.empty()
+            return False, job
+        if job["status"] in ("completed", "failed"):
+            progress_bar.empty()
+            if job["status"] == "completed":
+                return True, job["result"]
+            return False, {"error": job.get("error") or "Indexing failed"}
+        
+        notes_total = job.get("notes_total", 0)
+        notes_processed = job.get("notes_processed", 0)
+        fraction = min(notes_processed / notes_total, 1.0) if notes_total else 0.0
+        progress_bar.progress(
+            fraction,
+            text=f"🔄 {job['stage'].capitalize()}: {notes_processed}/{notes_total} notes, "
+                 f"{job.get('chunks_written', 0)} chunks embedded ({job.get('chunks_per_second', 0)} chunks/s)"
+        )
+        time.sleep(JOB_POLL_INTERVAL)
+
+def query_rag_stream(query: str, mode: str):
+    """Send query to RAG backend and yield its streamed events (sources, tokens, done)"""
+    try:
+        payload = {"query": query, "mode": mode, "session_id": st.session_state.vault_session_id}
+        with requests.post(f"{BACKEND_URL}/rag_query/stream", json=payload, stream=True) as response:
+            if response.status_code != 200:
+                yield {"type": "error", "error": "Failed to get response from backend"}
+                return
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    yield json.loads(line)
+    except requests.exceptions.ConnectionError:
+        yield {"type": "error", "error": "Cannot connect to backend. Make sure the FastAPI server is running on port 8000."}
+    except Exception as e:
+        yield {"type": "error", "error": str(e)}
+
 def clear_documents():
-    """Clear all documents from backend"""
+    """Clear this session's vault on the backend"""
     try:
-        response = requests.post(f"{BACKEND_URL}/clear-documents")
+        params = {"session_id": st.session_state.vault_session_id} if st.session_state.vault_session_id else {}
+        response = requests.post(f"{BACKEND_URL}/clear-documents", params=params)
         if response.status_code == 200:
             return True, response.json()
         else:
@@ -334,6 +389,20 @@ def clear_documents():
     except Exception as e:
         return False, {"error": str(e)}
 
+def delete_vault():
+    """Delete this session's vault on the backend"""
+    try:
+        response = requests.delete(f"{BACKEND_URL}/vaults/{st.session_state.vault_session_id}")
+        # Already gone (e.g. deleted from another tab) is as good as deleted
+        if response.status_code in (200, 404):
+            return True, response.json()
+        else:
+            return False, {"error": "Failed to delete vault"}
+    except requests.exceptions.ConnectionError:
+        return False, {"error": "Cannot connect to backend"}
+    except Exception as e:
+        return False, {"error": str(e)}
+
 
 
 def upload_page():
@@ -370,20 +439,25 @@ def upload_page():
             ''', unsafe_allow_html=True)
             
             if st.button("🚀 Upload & Process Vault", type="primary", use_container_width=True):
-                with st.spinner("🔄 Processing your vault..."):
+                with st.spinner("📤 Uploading your vault..."):
                     success, result = upload_vault(uploaded_file)
+                
+                if success:
+                    st.session_state.vault_session_id = result["session_id"]
+                    st.query_params["vault"] = result["session_id"]
+                    success, result = wait_for_ingestion(result["job_id"])
                     
-                    if success:
-                        st.session_state.documents_uploaded = True
-                        st.session_state.current_page = 'chat'
-                        st.success(f"✅ {result['message']}")
-                        st.info(f"📄 Files processed: {result['file_count']}")
-                        st.info(f"📚 Documents added: {result['documents_added']}")
-                        st.balloons()
-                        time.sleep(2)
-                        st.rerun()
-                    else:
-                        st.error(f"❌ Upload failed: {result['error']}")
+                if success:
+                    st.session_state.documents_uploaded = True
+                    st.session_state.current_page = 'chat'
+                    st.success(f"✅ {result['message']}")
+                    st.info(f"📄 Files processed: {result['file_count']}")
+                    st.info(f"📚 Documents added: {result['documents_added']}")
+                    st.balloons()
+                    time.sleep(2)
+                    st.rerun()
+                else:
+                    st.error(f"❌ Upload failed: {result['error']}")
         
         st.markdown('</div>', unsafe_allow_html=True)
         
@@ -416,9 +490,14 @@ def chat_page():
     
     with col_nav:
         st.markdown("<br><br>", unsafe_allow_html=True)
-        if st.button("🔄 New Vault", help="Upload a new vault"):
-            success, result = clear_documents()
+        if st.button("🔄 New Vault", help="Delete this vault and upload a new one"):
+            if st.session_state.vault_session_id:
+                success, result = delete_vault()
+            else:
+                success, result = clear_documents()
             if success:
+                st.session_state.vault_session_id = None
+                st.query_params.pop("vault", None)
                 st.session_state.documents_uploaded = False
                 st.session_state.chat_history = []
                 st.session_state.last_retrieved_docs = []
@@ -435,14 +514,15 @@ def chat_page():
         
         mode_options = {
             'qa': '❓ Q&A Mode - Ask specific questions',
-            'summarize': '📝 Summarize Mode - Get comprehensive summaries'
+            'summarize': '📝 Summarize Mode - Get comprehensive summaries',
+            'summarize_fast': '⚡ Fast Summarize Mode - Quicker summaries, in parallel'
         }
         
         selected_mode_display = st.selectbox(
             "Choose how you want to interact with your notes:",
             options=list(mode_options.keys()),
             format_func=lambda x: mode_options[x],
-            index=0 if st.session_state.selected_mode == 'qa' else 1,
+            index=list(mode_options.keys()).index(st.session_state.selected_mode),
             key="mode_selector"
         )
         
@@ -458,13 +538,20 @@ def chat_page():
                 <span style="color: #2e7d32;">💡 <strong>Q&A Mode:</strong> Ask specific questions about your notes and get direct, focused answers.</span>
             </div>
             ''', unsafe_allow_html=True)
-        else:
+        elif st.session_state.selected_mode == 'summarize':
             st.markdown('''
             <div style="background: linear-gradient(135deg, #fff3e0 0%, #e8f5e9 100%); 
                         padding: 0.8rem; border-radius: 8px; margin-top: 0.5rem;">
                 <span style="color: #2e7d32;">💡 <strong>Summarize Mode:</strong> Request comprehensive summaries on topics from your notes.</span>
             </div>
             ''', unsafe_allow_html=True)
+        else:
+            st.markdown('''
+            <div style="background: linear-gradient(135deg, #fff3e0 0%, #e8f5e9 100%); 
+                        padding: 0.8rem; border-radius: 8px; margin-top: 0.5rem;">
+                <span style="color: #2e7d32;">💡 <strong>Fast Summarize Mode:</strong> Summarizes groups of related notes in parallel, then combines them. Faster and more predictable than Summarize Mode.</span>
+            </div>
+            ''', unsafe_allow_html=True)
         
         st.markdown('</div>', unsafe_allow_html=True)
         
@@ -531,21 +618,45 @@ def chat_page():
             st.rerun()
         
         if send_button and user_input:
-            with st.spinner(f"🤔 {'Thinking about your question' if st.session_state.selected_mode == 'qa' else 'Creating comprehensive summary'}..."):
-                success, result = query_rag(user_input, st.session_state.selected_mode)
+            status_text = 'Thinking about your question' if st.session_state.selected_mode == 'qa' else 'Creating comprehensive summary'
+            answer_placeholder = st.empty()
+            answer_placeholder.markdown(f'''
+            <div class="assistant-message fade-in">
+                <div class="message-label">🤖 Assistant</div>
+                <div>🤔 {status_text}...</div>
+            </div>
+            ''', unsafe_allow_html=True)
+            
+            answer = ""
+            documents = []
+            error = None
+            for event in query_rag_stream(user_input, st.session_state.selected_mode):
+                if event["type"] == "sources":
+                    documents = event["documents"]
+                elif event["type"] == "token":
+                    answer += event["content"]
+                    answer_placeholder.markdown(f'''
+                    <div class="assistant-message fade-in">
+                        <div class="message-label">🤖 Assistant</div>
+                        <div>{answer}</div>
+                    </div>
+                    ''', unsafe_allow_html=True)
+                elif event["type"] == "done":
+                    answer = event["answer"]
+                elif event["type"] == "error":
+                    error = event["error"]
+                    break
+            
+            if error is None:
+                # Add to chat history with mode
+                st.session_state.chat_history.append((user_input, answer, documents, st.session_state.selected_mode))
+                st.session_state.last_retrieved_docs = documents
                 
-                if success:
-                    answer = result['answer']
-                    documents = result.get('documents', [])
-                    
-                    # Add to chat history with mode
-                    st.session_state.chat_history.append((user_input, answer, documents, st.session_state.selected_mode))
-                    st.session_state.last_retrieved_docs = documents
-                    
-                    # Clear input and rerun
-                    st.rerun()
-                else:
-                    st.error(f"❌ Query failed: {result['error']}")
+                # Clear input and rerun
+                st.rerun()
+            else:
+                answer_placeholder.empty()
+                st.error(f"❌ Query failed: {error}")
         
         st.markdown('</div>', unsafe_allow_html=True)
     
@@ -604,5 +715,4 @@ def main():
         chat_page()
 
 if __name__ == "__main__":
-    import time
     main()
\ No newline at end of file
@@ -0,0 +1,69 @@
+"""Concurrent summarize runs must not see each other's sources.
+
+The summarize agent and its tools are built once and shared by every request;
+each run's state lives in a context variable. This runs many summaries at once
+with a fake LLM and a stub retriever and checks every run's sources are its own.
+"""
+import os
+import random
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from langchain_core.documents import Document
+from langchain_core.language_models.llms import LLM
+from langchain_core.runnables import RunnableLambda
+
+import rag_chain_config
+
+
+class EchoLLM(LLM):
+    """Searches the vault for the topic in its prompt once, then gives the final answer"""
+
+    @property
+    def _llm_type(self):
+        return "echo"
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        topic = re.search(r"Create a comprehensive summary about: (\S+)", prompt).group(1)
+        # The template itself describes the format; only look at this run's steps
+        if "Observation:" not in prompt.split("Begin!")[1]:
+            return f"I should search the vault.\nAction: search_vault\nAction Input: {topic}"
+        return f"I now know the final answer\nFinal Answer: summary of {topic}"
+
+
+class StubVectorStore:
+    """Returns two chunks named after the query, after a short random delay"""
+
+    def as_retriever(self, **kwargs):
+        def retrieve(query):
+            time.sleep(random.uniform(0, 0.01))
+            return [
+                Document(id=f"{query}-{i}", page_content=f"{query} chunk {i}", metadata={"source": f"{query}-{i}.md"})
+                for i in range(2)
+            ]
+        return RunnableLambda(retrieve)
+
+
+class StubVault:
+    vectorstore = StubVectorStore()
+    lexical_index = None
+
+
+def test_concurrent_summaries_keep_their_own_sources(monkeypatch):
+    monkeypatch.setattr(rag_chain_config, "llm", EchoLLM())
+    monkeypatch.setattr(rag_chain_config, "HYBRID_RETRIEVAL", False)
+    mode = rag_chain_config.SummarizeMode()
+    mode.agent_executor.verbose = False
+    vault = StubVault()
+    topics = [f"topic-{i}" for i in range(100)]
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        results = list(executor.map(lambda topic: mode.run(topic, vault), topics))
+
+    for topic, result in zip(topics, results):
+        assert result["answer"] == f"summary of {topic}"
+        assert sorted(doc.metadata["source"] for doc in result["documents"]) == [f"{topic}-0.md", f"{topic}-1.md"]